@@ -0,0 +1,300 @@
+"""
+Admission control and load shedding
+"""
+
+import asyncio
+import math
+import os
+from collections import OrderedDict, deque
+from time import monotonic
+
+from fastapi import status
+from fastapi.responses import ORJSONResponse
+
+from token_cache import token_cache
+
+# Every request is put in a route class and has to get through two gates before it runs:
+#   a token bucket per user (client IP for anonymous requests) throttling how fast a
+#   single client can send requests, answered with 429 when empty
+#   a concurrency limit per route class with a bounded wait queue, answered with 503 when
+#   the queue is full or the wait times out
+# Both answers carry Retry-After and are sent before any work is done, so under a spike the
+# excess is shed in microseconds instead of queueing without limit inside uvicorn.
+#
+# Route classes keep the expensive requests from starving the cheap ones: bcrypt logins
+# and signups (auth) get a small limit and a stricter bucket of their own, so a login storm
+# cannot take the slots of reads and writes. Long lived event streams only count against
+# their own limit. Exempt paths are never limited.
+#
+# The limiters and buckets live on the event loop thread and are only touched from it.
+
+ADMISSION_ENABLED = os.environ.get("ADMISSION_ENABLED", "true").lower() == "true"
+
+RATE_LIMIT_ENABLED = os.environ.get("RATE_LIMIT_ENABLED", "true").lower() == "true"
+
+# concurrent requests and queued requests per route class
+ADMISSION_AUTH_CONCURRENCY = int(os.environ.get("ADMISSION_AUTH_CONCURRENCY", 8))
+
+ADMISSION_AUTH_QUEUE = int(os.environ.get("ADMISSION_AUTH_QUEUE", 16))
+
+ADMISSION_READ_CONCURRENCY = int(os.environ.get("ADMISSION_READ_CONCURRENCY", 100))
+
+ADMISSION_READ_QUEUE = int(os.environ.get("ADMISSION_READ_QUEUE", 200))
+
+ADMISSION_WRITE_CONCURRENCY = int(os.environ.get("ADMISSION_WRITE_CONCURRENCY", 50))
+
+ADMISSION_WRITE_QUEUE = int(os.environ.get("ADMISSION_WRITE_QUEUE", 100))
+
+# open event streams, held for as long as the client is connected so they are never queued
+ADMISSION_STREAM_CONCURRENCY = int(os.environ.get("ADMISSION_STREAM_CONCURRENCY", 1000))
+
+# seconds a queued request waits for a slot before it is shed
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ADMISSION_QUEUE_TIMEOUT", 5))
+
+# requests per second and burst size of every user's (or IP's) bucket
+RATE_LIMIT_RATE = float(os.environ.get("RATE_LIMIT_RATE", 20))
+
+RATE_LIMIT_BURST = float(os.environ.get("RATE_LIMIT_BURST", 40))
+
+# the stricter bucket of the auth routes, per client IP
+AUTH_RATE_LIMIT_RATE = float(os.environ.get("AUTH_RATE_LIMIT_RATE", 1))
+
+AUTH_RATE_LIMIT_BURST = float(os.environ.get("AUTH_RATE_LIMIT_BURST", 10))
+
+# buckets kept before the least recently used ones are dropped
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", 10000))
+
+EXEMPT_PATHS = ("/healthcheck", "/metrics")
+
+AUTH_PATHS = ("/auth/token", "/auth/users")
+
+STREAM_PATHS = ("/todos/stream",)
+
+READ_METHODS = ("GET", "HEAD", "OPTIONS")
+
+
+class Rejected(Exception):
+    """
+    Raised when a request is not admitted
+    """
+
+    def __init__(self, status_code: int, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.status_code = status_code
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class ConcurrencyLimiter:
+    """
+    At most limit requests at a time, at most queue_size more waiting in FIFO order
+    """
+
+    def __init__(self, limit: int, queue_size: int, timeout: float):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.active = 0
+        self.waiters: deque[asyncio.Future] = deque()
+
+    async def acquire(self):
+        """Take a slot, waiting in the queue when all are taken"""
+        if self.active < self.limit and not self.waiters:
+            self.active += 1
+            return
+        if len(self.waiters) >= self.queue_size:
+            raise Rejected(status.HTTP_503_SERVICE_UNAVAILABLE, "queue_full", 1)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters.append(waiter)
+        try:
+            await asyncio.wait_for(waiter, self.timeout)
+        except BaseException as exp:
+            if waiter in self.waiters:
+                self.waiters.remove(waiter)
+            timed_out = isinstance(exp, asyncio.TimeoutError)
+            # the slot may have been handed over just as the wait ended
+            if waiter.done() and not waiter.cancelled():
+                if timed_out:
+                    return
+                self.release()
+            if timed_out:
+                raise Rejected(
+                    status.HTTP_503_SERVICE_UNAVAILABLE, "queue_timeout", 1
+                ) from exp
+            raise
+
+    def release(self):
+        """Hand the slot to the next waiter, or free it"""
+        while self.waiters:
+            waiter = self.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+
+class TokenBuckets:
+    """
+    A token bucket per key refilled at rate tokens per second up to burst tokens.
+    Only the max_keys most recently used buckets are kept, a dropped bucket starts full.
+    """
+
+    def __init__(self, rate: float, burst: float, max_keys: int):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        # key -> (tokens, last refill time)
+        self.buckets: OrderedDict[str, tuple[float, float]] = OrderedDict()
+
+    def take(self, key: str) -> float:
+        """
+        Take a token from the bucket of key.
+        Returns 0 when there was one, otherwise the seconds until there is.
+        """
+        now = monotonic()
+        tokens, updated = self.buckets.pop(key, (self.burst, now))
+        tokens = min(self.burst, tokens + (now - updated) * self.rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / self.rate
+        self.buckets[key] = (tokens, now)
+        if len(self.buckets) > self.max_keys:
+            self.buckets.popitem(last=False)
+        return wait
+
+
+limiters = {
+    "auth": ConcurrencyLimiter(
+        ADMISSION_AUTH_CONCURRENCY, ADMISSION_AUTH_QUEUE, ADMISSION_QUEUE_TIMEOUT
+    ),
+    "read": ConcurrencyLimiter(
+        ADMISSION_READ_CONCURRENCY, ADMISSION_READ_QUEUE, ADMISSION_QUEUE_TIMEOUT
+    ),
+    "write": ConcurrencyLimiter(
+        ADMISSION_WRITE_CONCURRENCY, ADMISSION_WRITE_QUEUE, ADMISSION_QUEUE_TIMEOUT
+    ),
+    "stream": ConcurrencyLimiter(ADMISSION_STREAM_CONCURRENCY, 0, 0),
+}
+
+user_buckets = TokenBuckets(RATE_LIMIT_RATE, RATE_LIMIT_BURST, RATE_LIMIT_MAX_KEYS)
+
+auth_buckets = TokenBuckets(
+    AUTH_RATE_LIMIT_RATE, AUTH_RATE_LIMIT_BURST, RATE_LIMIT_MAX_KEYS
+)
+
+# (route class, reason) -> rejected requests
+rejections: dict[tuple[str, str], int] = {}
+
+
+def route_class(method: str, path: str) -> str | None:
+    """Route class of a request, None for exempt paths"""
+    if path in EXEMPT_PATHS:
+        return None
+    if path in AUTH_PATHS and method == "POST":
+        return "auth"
+    if path in STREAM_PATHS:
+        return "stream"
+    if method in READ_METHODS:
+        return "read"
+    return "write"
+
+
+def client_key(scope) -> str:
+    """
+    Bucket key of a request: the user id when its bearer token has already been
+    verified (and cached), otherwise the client IP
+    """
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer":
+                payload = token_cache.peek(token)
+                if payload is not None and payload.get("id") is not None:
+                    return f"user:{payload['id']}"
+            break
+    client = scope.get("client")
+    return f"ip:{client[0] if client else 'unknown'}"
+
+
+def admit_rate(scope, request_class: str):
+    """Take a token from the client's bucket, raises Rejected when it is empty"""
+    if request_class == "auth":
+        client = scope.get("client")
+        wait = auth_buckets.take(client[0] if client else "unknown")
+    else:
+        wait = user_buckets.take(client_key(scope))
+    if wait:
+        raise Rejected(status.HTTP_429_TOO_MANY_REQUESTS, "rate_limited", wait)
+
+
+class AdmissionMiddleware:
+    """
+    ASGI middleware throttling clients and limiting concurrency per route class
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        request_class = route_class(scope["method"], scope["path"])
+        if request_class is None:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = limiters[request_class]
+        try:
+            if RATE_LIMIT_ENABLED:
+                admit_rate(scope, request_class)
+            await limiter.acquire()
+        except Rejected as exp:
+            key = (request_class, exp.reason)
+            rejections[key] = rejections.get(key, 0) + 1
+            response = ORJSONResponse(
+                status_code=exp.status_code,
+                content={"detail": {"msg": "Too many requests, retry later"}},
+                headers={"Retry-After": str(math.ceil(exp.retry_after))},
+            )
+            await response(scope, receive, send)
+            return
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            limiter.release()
+
+
+def render_admission_metrics() -> str:
+    """
+    Rejections, in flight and queued requests per route class in the Prometheus text
+    exposition format
+    """
+    lines = [
+        "# HELP admission_rejections_total Requests shed by route class and reason",
+        "# TYPE admission_rejections_total counter",
+    ]
+    for (request_class, reason), count in rejections.items():
+        lines.append(
+            f'admission_rejections_total{{class="{request_class}",reason="{reason}"}} '
+            f"{count}"
+        )
+    lines += [
+        "# HELP admission_in_flight Requests running by route class",
+        "# TYPE admission_in_flight gauge",
+    ]
+    for request_class, limiter in limiters.items():
+        lines.append(f'admission_in_flight{{class="{request_class}"}} {limiter.active}')
+    lines += [
+        "# HELP admission_queued Requests waiting for a slot by route class",
+        "# TYPE admission_queued gauge",
+    ]
+    for request_class, limiter in limiters.items():
+        lines.append(
+            f'admission_queued{{class="{request_class}"}} {len(limiter.waiters)}'
+        )
+    return "\n".join(lines) + "\n"
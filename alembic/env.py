@@ -31,6 +31,15 @@ config.set_main_option("sqlalchemy.url", database_url)
 # target_metadata = mymodel.Base.metadata
 target_metadata = Base.metadata
 
+# full-text search objects created by raw DDL (see search.py), not part of the models
+SEARCH_OBJECTS = {"search_vector", "ix_todos_search_vector", "todos_fts"}
+
+
+def include_object(obj, name, type_, reflected, compare_to):
+    """Keep autogenerate from dropping the full-text search objects"""
+    return not (reflected and (name in SEARCH_OBJECTS or name.startswith("todos_fts_")))
+
+
 # other values from the config, defined by the needs of env.py,
 # can be acquired:
 # my_important_option = config.get_main_option("my_important_option")
@@ -53,6 +62,7 @@ def run_migrations_offline() -> None:
     context.configure(
         url=url,
         target_metadata=target_metadata,
+        include_object=include_object,
         literal_binds=True,
         dialect_opts={"paramstyle": "named"},
     )
@@ -75,7 +85,11 @@ def run_migrations_online() -> None:
     )
 
     with connectable.connect() as connection:
-        context.configure(connection=connection, target_metadata=target_metadata)
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            include_object=include_object,
+        )
 
         with context.begin_transaction():
             context.run_migrations()
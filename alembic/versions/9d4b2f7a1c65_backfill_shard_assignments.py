@@ -0,0 +1,33 @@
+"""backfill shard assignments
+
+Revision ID: 9d4b2f7a1c65
+Revises: e58a2d7c9b31
+Create Date: 2026-10-18 21:48:12.305517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d4b2f7a1c65'
+down_revision: Union[str, None] = 'e58a2d7c9b31'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # the todos of the existing users are on the primary, pin them there so turning
+    # shards on does not send them to the shard SHARD_STRATEGY would pick
+    op.execute(
+        "INSERT INTO shard_assignments (owner_id, shard) "
+        "SELECT id, 0 FROM users "
+        "WHERE id NOT IN (SELECT owner_id FROM shard_assignments)"
+    )
+
+
+def downgrade() -> None:
+    # the assignments are kept, they only say where the todos are
+    pass
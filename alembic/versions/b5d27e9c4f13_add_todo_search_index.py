@@ -0,0 +1,66 @@
+"""add todo search index
+
+Revision ID: b5d27e9c4f13
+Revises: 8e41b7c05d2a
+Create Date: 2026-10-18 14:26:51.307214
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b5d27e9c4f13'
+down_revision: Union[str, None] = '8e41b7c05d2a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        # generated column, postgres keeps it in sync on every insert and update
+        op.execute(
+            "ALTER TABLE todos ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+            "to_tsvector('english', coalesce(title, '') || ' ' || coalesce(description, ''))"
+            ") STORED"
+        )
+        op.execute('CREATE INDEX ix_todos_search_vector ON todos USING gin (search_vector)')
+    elif dialect == 'sqlite':
+        # external content FTS5 table kept in sync by triggers
+        op.execute(
+            "CREATE VIRTUAL TABLE todos_fts USING fts5("
+            "title, description, content='todos', content_rowid='id')"
+        )
+        op.execute(
+            "CREATE TRIGGER todos_fts_insert AFTER INSERT ON todos BEGIN "
+            "INSERT INTO todos_fts(rowid, title, description) "
+            "VALUES (new.id, new.title, new.description); END"
+        )
+        op.execute(
+            "CREATE TRIGGER todos_fts_delete AFTER DELETE ON todos BEGIN "
+            "INSERT INTO todos_fts(todos_fts, rowid, title, description) "
+            "VALUES ('delete', old.id, old.title, old.description); END"
+        )
+        op.execute(
+            "CREATE TRIGGER todos_fts_update AFTER UPDATE OF title, description ON todos BEGIN "
+            "INSERT INTO todos_fts(todos_fts, rowid, title, description) "
+            "VALUES ('delete', old.id, old.title, old.description); "
+            "INSERT INTO todos_fts(rowid, title, description) "
+            "VALUES (new.id, new.title, new.description); END"
+        )
+        # index the existing todos
+        op.execute("INSERT INTO todos_fts(todos_fts) VALUES ('rebuild')")
+
+
+def downgrade() -> None:
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('DROP INDEX ix_todos_search_vector')
+        op.execute('ALTER TABLE todos DROP COLUMN search_vector')
+    elif dialect == 'sqlite':
+        op.execute('DROP TRIGGER todos_fts_update')
+        op.execute('DROP TRIGGER todos_fts_delete')
+        op.execute('DROP TRIGGER todos_fts_insert')
+        op.execute('DROP TABLE todos_fts')
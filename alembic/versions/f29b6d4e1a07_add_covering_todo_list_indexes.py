@@ -0,0 +1,36 @@
+"""add covering todo list indexes
+
+Revision ID: f29b6d4e1a07
+Revises: d71c3a8e5b24
+Create Date: 2026-10-18 17:12:44.918305
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f29b6d4e1a07'
+down_revision: Union[str, None] = 'd71c3a8e5b24'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    # INCLUDE is postgres only, the indexes stay as they are elsewhere
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_todos_owner_id_id', table_name='todos')
+    op.create_index('ix_todos_owner_id_id', 'todos', ['owner_id', 'id'], unique=False, postgresql_include=['title', 'is_complete'])
+    op.drop_index('ix_todos_owner_id_priority_id', table_name='todos')
+    op.create_index('ix_todos_owner_id_priority_id', 'todos', ['owner_id', 'priority', 'id'], unique=False, postgresql_include=['title', 'is_complete'])
+
+
+def downgrade() -> None:
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+    op.drop_index('ix_todos_owner_id_priority_id', table_name='todos')
+    op.create_index('ix_todos_owner_id_priority_id', 'todos', ['owner_id', 'priority', 'id'], unique=False)
+    op.drop_index('ix_todos_owner_id_id', table_name='todos')
+    op.create_index('ix_todos_owner_id_id', 'todos', ['owner_id', 'id'], unique=False)
@@ -1,13 +1,101 @@
 """
 App
 """
-from fastapi import FastAPI
+
+from time import perf_counter
+
 from dotenv import load_dotenv
 
-from router import auth, healthcheck, todo, admin
+IMPORT_STARTED = perf_counter()
 
+# load the environment before importing modules that read their settings from it
 load_dotenv()
 
+# pylint: disable=wrong-import-position
+from contextlib import asynccontextmanager  # noqa: E402
+
+from fastapi import FastAPI  # noqa: E402
+from fastapi.responses import ORJSONResponse  # noqa: E402
+from sqlalchemy import select  # noqa: E402
+
+import database  # noqa: E402
+from archive import ARCHIVE_ENABLED, archiver  # noqa: E402
+from events import event_hub  # noqa: E402
+from logs import (  # noqa: E402
+    RequestIdMiddleware,
+    get_logger,
+    start_logging,
+    stop_logging,
+)
+from admission import ADMISSION_ENABLED, AdmissionMiddleware  # noqa: E402
+from metrics import MetricsMiddleware, startup_timings  # noqa: E402
+from models import Todo, User  # noqa: E402
+from pagination import paginate_todos  # noqa: E402
+from replicas import replica_set  # noqa: E402
+from shards import shard_map  # noqa: E402
+from router import auth, healthcheck, todo, admin, metrics  # noqa: E402
+
+startup_timings["import"] = perf_counter() - IMPORT_STARTED
+
+logger = get_logger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI):
+    """
+    Create the engines (replicas and shards included), check the schema and warm up
+    before serving, dispose on shutdown.
+    Every phase is timed and exposed as app_startup_seconds on /metrics.
+    """
+    started = perf_counter()
+    start_logging()
+    database.init_engines()
+    startup_timings["engines"] = perf_counter() - started
+
+    if replica_set.replicas:
+        phase_started = perf_counter()
+        await replica_set.start()
+        startup_timings["replicas"] = perf_counter() - phase_started
+
+    if database.DB_CREATE_SCHEMA:
+        phase_started = perf_counter()
+        await database.create_schema()
+        startup_timings["schema"] = perf_counter() - phase_started
+
+    if shard_map.shards:
+        phase_started = perf_counter()
+        await shard_map.start(database.DB_CREATE_SCHEMA)
+        startup_timings["shards"] = perf_counter() - phase_started
+
+    if database.DB_WARMUP:
+        phase_started = perf_counter()
+        await database.warm_up(
+            [
+                select(User.todos_version).where(User.id == 0),
+                paginate_todos(
+                    select(*Todo.__table__.columns).where(Todo.owner_id == 0), None, 1
+                ),
+            ]
+        )
+        startup_timings["warm_up"] = perf_counter() - phase_started
+
+    await event_hub.start()
+    if ARCHIVE_ENABLED:
+        archiver.start()
+
+    startup_timings["total"] = startup_timings["import"] + perf_counter() - started
+    logger.info(
+        "Startup completed",
+        extra={"startup_seconds": round(startup_timings["total"], 3)},
+    )
+    yield
+    await archiver.stop()
+    await event_hub.stop()
+    await shard_map.stop()
+    await replica_set.stop()
+    await database.dispose_engines()
+    stop_logging()
+
 
 app = FastAPI(
     title="Todo Manager",
@@ -15,10 +103,20 @@ app = FastAPI(
     version="1.1.0",
     contact={"name": "chandanch"},
     summary="Manage Todos Easily",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
 )
 
+# added first so it runs inside the metrics middleware and queueing counts as latency
+if ADMISSION_ENABLED:
+    app.add_middleware(AdmissionMiddleware)
+app.add_middleware(MetricsMiddleware)
+# outermost, so every response, rejected ones included, carries its X-Request-ID
+app.add_middleware(RequestIdMiddleware)
+
 
 app.include_router(router=auth.router)
 app.include_router(router=healthcheck.router)
 app.include_router(router=todo.router)
 app.include_router(router=admin.router)
+app.include_router(router=metrics.router)
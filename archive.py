@@ -0,0 +1,220 @@
+"""
+Archival of completed todos out of the todos table
+
+Archive every todo completed more than ARCHIVE_AFTER_DAYS ago, on every shard, with:
+
+    python archive.py run
+"""
+
+import asyncio
+import os
+import sys
+from collections import defaultdict
+from time import time
+
+from sqlalchemy import delete, func, insert, select, update
+
+from cache import invalidate_todos
+from models import ArchivedTodo, Todo, User
+from shards import shard_map
+from todo_stats import STATS_DIMENSIONS
+
+# Completed todos are most of the rows but are rarely read, so once they have been
+# completed for ARCHIVE_AFTER_DAYS a background job moves them to todos_archive, which has
+# the same columns. This keeps todos and its (owner_id, ...) indexes down to the todos in
+# use. Reads only include the archive when asked to (?include_archived=true), merging the
+# page of each table in the requested order.
+#
+# The job moves ARCHIVE_BATCH_SIZE todos per transaction and pauses between batches, so
+# it never holds locks for long. On Postgres rows locked by a writer are skipped until the
+# next run, which also lets every worker run the job at the same time.
+# Every batch bumps the todos_version of the owners it touched (their list ETag) and drops
+# their cached reads. Archived todos can be deleted but not updated (409), their counts
+# stay in todo_stats.
+
+ARCHIVE_ENABLED = os.environ.get("ARCHIVE_ENABLED", "true").lower() == "true"
+
+# days a todo has been completed before it is archived
+ARCHIVE_AFTER_DAYS = float(os.environ.get("ARCHIVE_AFTER_DAYS", 30))
+
+# todos moved per transaction
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", 500))
+
+# seconds between runs of the background job
+ARCHIVE_INTERVAL = float(os.environ.get("ARCHIVE_INTERVAL", 600))
+
+# seconds between two batches, leaves room for the writers
+ARCHIVE_BATCH_PAUSE = 0.1
+
+
+def completion_time(is_complete: bool) -> int | None:
+    """completed_at of a todo written with is_complete, when it was not complete yet"""
+    return int(time()) if is_complete else None
+
+
+async def delete_archived(db, owner_id: int, ids) -> list:
+    """
+    Delete the archived todos of owner_id among ids.
+    Returns the id and stats columns of the deleted todos. Runs in the caller's transaction.
+    """
+    table = ArchivedTodo.__table__
+    return (
+        await db.execute(
+            delete(table)
+            .where(table.c.id.in_(ids))
+            .where(table.c.owner_id == owner_id)
+            .returning(table.c.id, *(table.c[name] for name in STATS_DIMENSIONS))
+        )
+    ).all()
+
+
+async def archived_ids(db, owner_id: int, ids) -> set[int]:
+    """The ids among ids of archived todos of owner_id"""
+    return set(
+        await db.scalars(
+            select(ArchivedTodo.id)
+            .where(ArchivedTodo.id.in_(ids))
+            .where(ArchivedTodo.owner_id == owner_id)
+        )
+    )
+
+
+async def archive_batch(db, cutoff: int) -> int:
+    """
+    Move up to ARCHIVE_BATCH_SIZE todos completed before cutoff to the archive.
+    Returns the number of todos moved. Commits.
+    """
+    statement = (
+        select(Todo.id, Todo.owner_id)
+        .where(Todo.is_complete.is_(True))
+        .where(Todo.completed_at < cutoff)
+        .order_by(Todo.completed_at, Todo.id)
+        .limit(ARCHIVE_BATCH_SIZE)
+    )
+    dialect = db.get_bind().dialect.name
+    if dialect == "postgresql":
+        statement = statement.with_for_update(skip_locked=True)
+    elif dialect == "sqlite":
+        # the highest id stays, so a todos table created without AUTOINCREMENT never
+        # hands out the id of an archived todo again
+        statement = statement.where(
+            Todo.id < select(func.max(Todo.id)).scalar_subquery()
+        )
+    todos = (await db.execute(statement)).all()
+    if not todos:
+        await db.rollback()
+        return 0
+
+    ids = [todo.id for todo in todos]
+    columns = Todo.__table__.columns
+    await db.execute(
+        insert(ArchivedTodo).from_select(
+            [column.key for column in columns], select(*columns).where(Todo.id.in_(ids))
+        )
+    )
+    await db.execute(
+        delete(Todo)
+        .where(Todo.id.in_(ids))
+        .execution_options(synchronize_session=False)
+    )
+    archived = defaultdict(list)
+    for todo in todos:
+        archived[todo.owner_id].append(todo.id)
+    await db.execute(
+        update(User)
+        .where(User.id.in_(sorted(archived)))
+        .values(todos_version=User.todos_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    await db.commit()
+    for owner_id, todo_ids in archived.items():
+        await invalidate_todos(owner_id, todo_ids)
+    return len(ids)
+
+
+async def archive_completed() -> int:
+    """
+    Archive the todos completed more than ARCHIVE_AFTER_DAYS ago on every shard.
+    Returns the number of todos moved.
+    """
+    cutoff = int(time() - ARCHIVE_AFTER_DAYS * 86400)
+    total = 0
+    for index in range(shard_map.count):
+        while True:
+            db = shard_map.new_session(index)
+            try:
+                moved = await archive_batch(db, cutoff)
+            finally:
+                await db.close()
+            total += moved
+            if moved < ARCHIVE_BATCH_SIZE:
+                break
+            await asyncio.sleep(ARCHIVE_BATCH_PAUSE)
+    return total
+
+
+class Archiver:
+    """
+    Runs archive_completed every ARCHIVE_INTERVAL seconds in the background
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.task = None
+        self.runs = 0
+        self.archived = 0
+        self.last_error = None
+
+    def start(self):
+        """Start the background runs"""
+        self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """Stop the background runs"""
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def run(self):
+        """Archive every interval seconds, a failed run is retried on the next one"""
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                self.archived += await archive_completed()
+                self.last_error = None
+            except Exception as exp:  # pylint: disable=broad-exception-caught
+                self.last_error = repr(exp)
+            self.runs += 1
+
+    def stats(self) -> dict:
+        """Runs, todos archived and the error of the last run"""
+        return {
+            "enabled": self.task is not None,
+            "after_days": ARCHIVE_AFTER_DAYS,
+            "runs": self.runs,
+            "archived": self.archived,
+            "last_error": self.last_error,
+        }
+
+
+archiver = Archiver(ARCHIVE_INTERVAL)
+
+
+async def main():
+    """Archive against the configured databases"""
+    # pylint: disable=import-outside-toplevel
+    from database import dispose_engines, init_engines
+
+    init_engines()
+    await shard_map.start(create_schema=False)
+    try:
+        print(f"Archived {await archive_completed()} todos")
+    finally:
+        await shard_map.stop()
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["run"]:
+        sys.exit(__doc__)
+    asyncio.run(main())
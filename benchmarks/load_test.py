@@ -0,0 +1,407 @@
+"""
+Load test for the Todo API
+
+Starts the app with uvicorn against a fresh SQLite file (or --database-url), seeds users
+and todos, drives a mixed workload of login, list, get, create, update and delete requests
+and reports throughput and p50/p95/p99 latency per endpoint. Results are saved as JSON and
+can be compared against a previous run with --compare.
+
+    python benchmarks/load_test.py --users 20 --todos-per-user 200 --duration 30 \
+        --output bench.json
+    python benchmarks/load_test.py --compare bench.json --output bench-new.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import httpx
+
+ROOT = Path(__file__).resolve().parent.parent
+
+BENCH_PASSWORD = "benchpass"
+
+# relative weight of every operation in the mixed workload
+WORKLOAD = {
+    "login": 5,
+    "list": 40,
+    "get": 30,
+    "create": 10,
+    "update": 10,
+    "delete": 5,
+}
+
+ENDPOINTS = {
+    "login": "POST /auth/token",
+    "list": "GET /todos",
+    "get": "GET /todos/{todo_id}",
+    "create": "POST /todos",
+    "update": "PUT /todos/{todo_id}",
+    "delete": "DELETE /todos/{todo_id}",
+}
+
+
+def parse_args():
+    """Command line options"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--database-url", help="defaults to a temporary SQLite file")
+    parser.add_argument("--users", type=int, default=10)
+    parser.add_argument("--todos-per-user", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument("--warmup", type=float, default=2, help="seconds, not recorded")
+    parser.add_argument("--seed", type=int, default=42, help="random seed")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="previous results JSON to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.10,
+        help="relative p95 increase reported as a regression",
+    )
+    parser.add_argument(
+        "--env",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="extra environment for the app, e.g. DB_ASYNC_ENABLED=false",
+    )
+    return parser.parse_args()
+
+
+def seed_database(database_url: str, users: int, todos_per_user: int) -> dict:
+    """
+    Create the schema and seed users with todos.
+    Returns the todo ids of every seeded username.
+    """
+    os.environ["SQLALCHEMY_DATABASE_URL"] = database_url
+    sys.path.insert(0, str(ROOT))
+
+    # pylint: disable=import-outside-toplevel
+    from passlib.context import CryptContext
+    from sqlalchemy import create_engine, insert, select
+
+    from models import Base, Todo, User
+
+    engine = create_engine(database_url)
+    Base.metadata.create_all(engine)
+    hashed_password = CryptContext(schemes=["bcrypt"]).hash(BENCH_PASSWORD)
+    todo_ids = {}
+
+    with engine.begin() as connection:
+        for index in range(users):
+            username = f"bench-user-{index}"
+            user_id = connection.execute(
+                insert(User)
+                .values(
+                    username=username,
+                    email=f"{username}@example.com",
+                    first_name="Bench",
+                    last_name="User",
+                    role="user",
+                    is_active=True,
+                    hashed_password=hashed_password,
+                )
+                .returning(User.id)
+            ).scalar_one()
+            connection.execute(
+                insert(Todo),
+                [
+                    {
+                        "title": f"todo {number}",
+                        "description": f"benchmark todo {number} of {username}",
+                        "priority": number % 5 + 1,
+                        "is_complete": number % 3 == 0,
+                        "owner_id": user_id,
+                        "category": "benchmark",
+                        "todo_type": "task",
+                    }
+                    for number in range(todos_per_user)
+                ],
+            )
+            todo_ids[username] = list(
+                connection.scalars(select(Todo.id).where(Todo.owner_id == user_id))
+            )
+    engine.dispose()
+    return todo_ids
+
+
+def free_port() -> int:
+    """Ask the OS for a free TCP port"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app(database_url: str, port: int, extra_env: list[str]) -> subprocess.Popen:
+    """Start uvicorn serving the app and wait until it answers the healthcheck"""
+    # every simulated user shares one IP and sends as fast as it can, so the per-client
+    # rate limit is off unless --env RATE_LIMIT_ENABLED=true asks for it
+    env = {
+        **os.environ,
+        "SQLALCHEMY_DATABASE_URL": database_url,
+        "RATE_LIMIT_ENABLED": "false",
+    }
+    env.update(item.split("=", 1) for item in extra_env)
+    process = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "app:app",
+            "--port",
+            str(port),
+            "--log-level",
+            "warning",
+            "--no-access-log",
+        ],
+        cwd=ROOT,
+        env=env,
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("app exited during startup")
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/healthcheck", timeout=1)
+            return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("app did not start within 30 seconds")
+
+
+def todo_body(rng: random.Random) -> dict:
+    """Random valid TodoCreate body"""
+    return {
+        "title": f"load test {rng.randint(0, 10**6)}",
+        "description": "created by the load test",
+        "priority": rng.randint(1, 5),
+        "is_complete": rng.random() < 0.3,
+        "category": "benchmark",
+        "todo_type": "task",
+    }
+
+
+class Recorder:
+    """
+    Latencies and errors per operation, recorded only after the warm-up
+    """
+
+    def __init__(self):
+        self.recording = False
+        self.latencies = {operation: [] for operation in WORKLOAD}
+        self.errors = {operation: 0 for operation in WORKLOAD}
+
+    def record(self, operation: str, latency: float, ok: bool):
+        """Record a finished request"""
+        if not self.recording:
+            return
+        self.latencies[operation].append(latency)
+        if not ok:
+            self.errors[operation] += 1
+
+
+async def worker(
+    client: httpx.AsyncClient,
+    username: str,
+    todo_ids: list[int],
+    rng: random.Random,
+    recorder: Recorder,
+    stop_at: float,
+):
+    """Run random operations as username until stop_at"""
+    operations = list(WORKLOAD)
+    weights = list(WORKLOAD.values())
+    headers = {}
+
+    async def call(operation, method, url, **kwargs):
+        start = time.perf_counter()
+        response = await client.request(method, url, headers=headers, **kwargs)
+        recorder.record(operation, time.perf_counter() - start, response.is_success)
+        return response
+
+    async def login():
+        response = await call(
+            "login",
+            "POST",
+            "/auth/token",
+            data={"username": username, "password": BENCH_PASSWORD},
+        )
+        if response.is_success:
+            headers["Authorization"] = f"Bearer {response.json()['access_token']}"
+
+    await login()
+    while time.monotonic() < stop_at:
+        operation = rng.choices(operations, weights)[0]
+        if operation in ("get", "update", "delete") and not todo_ids:
+            operation = "create"
+        if operation == "login":
+            await login()
+        elif operation == "list":
+            await call("list", "GET", "/todos")
+        elif operation == "get":
+            await call("get", "GET", f"/todos/{rng.choice(todo_ids)}")
+        elif operation == "create":
+            response = await call("create", "POST", "/todos", json=todo_body(rng))
+            if response.is_success:
+                todo_ids.append(response.json()["id"])
+        elif operation == "update":
+            await call(
+                "update", "PUT", f"/todos/{rng.choice(todo_ids)}", json=todo_body(rng)
+            )
+        else:
+            todo_id = todo_ids.pop(rng.randrange(len(todo_ids)))
+            await call("delete", "DELETE", f"/todos/{todo_id}")
+
+
+async def run_workload(port: int, todo_ids: dict, args) -> Recorder:
+    """Drive the mixed workload with args.concurrency concurrent clients"""
+    recorder = Recorder()
+    usernames = list(todo_ids)
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=30
+    ) as client:
+        stop_at = time.monotonic() + args.warmup + args.duration
+        workers = [
+            asyncio.create_task(
+                worker(
+                    client,
+                    usernames[index % len(usernames)],
+                    # workers sharing a user share its ids so deletes are not repeated
+                    todo_ids[usernames[index % len(usernames)]],
+                    random.Random(args.seed + index),
+                    recorder,
+                    stop_at,
+                )
+            )
+            for index in range(args.concurrency)
+        ]
+        await asyncio.sleep(args.warmup)
+        recorder.recording = True
+        await asyncio.gather(*workers)
+    return recorder
+
+
+def percentile(latencies: list[float], fraction: float) -> float:
+    """Nearest-rank percentile of sorted latencies, in milliseconds"""
+    if not latencies:
+        return 0.0
+    rank = max(int(round(fraction * len(latencies) + 0.5)) - 1, 0)
+    return latencies[min(rank, len(latencies) - 1)] * 1000
+
+
+def summarize(recorder: Recorder, duration: float) -> dict:
+    """Throughput and latency percentiles per endpoint"""
+    results = {}
+    everything = []
+    for operation, latencies in recorder.latencies.items():
+        latencies.sort()
+        everything += latencies
+        results[ENDPOINTS[operation]] = {
+            "requests": len(latencies),
+            "errors": recorder.errors[operation],
+            "throughput_rps": len(latencies) / duration,
+            "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+            "p50_ms": percentile(latencies, 0.50),
+            "p95_ms": percentile(latencies, 0.95),
+            "p99_ms": percentile(latencies, 0.99),
+        }
+    everything.sort()
+    results["total"] = {
+        "requests": len(everything),
+        "errors": sum(recorder.errors.values()),
+        "throughput_rps": len(everything) / duration,
+        "mean_ms": sum(everything) / len(everything) * 1000 if everything else 0.0,
+        "p50_ms": percentile(everything, 0.50),
+        "p95_ms": percentile(everything, 0.95),
+        "p99_ms": percentile(everything, 0.99),
+    }
+    return results
+
+
+def print_results(results: dict):
+    """Print the results as a table"""
+    print(
+        f"{'endpoint':<26}{'requests':>10}{'errors':>8}{'rps':>10}"
+        f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+    )
+    for endpoint, result in results.items():
+        print(
+            f"{endpoint:<26}{result['requests']:>10}{result['errors']:>8}"
+            f"{result['throughput_rps']:>10.1f}{result['p50_ms']:>10.2f}"
+            f"{result['p95_ms']:>10.2f}{result['p99_ms']:>10.2f}"
+        )
+
+
+def compare_results(previous: dict, current: dict, threshold: float) -> bool:
+    """
+    Print the p95 change of every endpoint against a previous run.
+    Returns True when any endpoint regressed by more than threshold.
+    """
+    regressed = False
+    print(f"\n{'endpoint':<26}{'old p95':>10}{'new p95':>10}{'change':>10}")
+    for endpoint, result in current.items():
+        old = previous.get(endpoint)
+        if not old or not old["p95_ms"]:
+            continue
+        change = result["p95_ms"] / old["p95_ms"] - 1
+        flag = ""
+        if change > threshold:
+            regressed = True
+            flag = "  REGRESSION"
+        print(
+            f"{endpoint:<26}{old['p95_ms']:>10.2f}{result['p95_ms']:>10.2f}"
+            f"{change:>+10.1%}{flag}"
+        )
+    return regressed
+
+
+def main():
+    """Seed, start the app, run the workload and report"""
+    args = parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        database_url = args.database_url or f"sqlite:///{tmp_dir}/bench.db"
+        todo_ids = seed_database(database_url, args.users, args.todos_per_user)
+        port = free_port()
+        process = start_app(database_url, port, args.env)
+        try:
+            recorder = asyncio.run(run_workload(port, todo_ids, args))
+        finally:
+            process.terminate()
+            process.wait()
+
+    results = summarize(recorder, args.duration)
+    print_results(results)
+    report = {
+        "config": {
+            "database": "sqlite" if not args.database_url else "custom",
+            "users": args.users,
+            "todos_per_user": args.todos_per_user,
+            "concurrency": args.concurrency,
+            "duration": args.duration,
+            "seed": args.seed,
+            "env": args.env,
+        },
+        "results": results,
+    }
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+    if args.compare:
+        previous = json.loads(Path(args.compare).read_text())["results"]
+        if compare_results(previous, results, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+Micro-benchmarks of the per-request hot paths
+
+Times the helpers every request goes through (token verification, serialization, cursor
+and ETag handling, the todo cache) in-process, without a database or a server.
+
+    python benchmarks/micro.py --output micro.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import timeit
+from datetime import timedelta
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def load_app_modules():
+    """Import the app modules against a throwaway in-memory database"""
+    os.environ.setdefault("SQLALCHEMY_DATABASE_URL", "sqlite://")
+    sys.path.insert(0, str(ROOT))
+    # pylint: disable=import-outside-toplevel,import-error
+    from fastapi.encoders import jsonable_encoder
+    from jose import jwt
+
+    import cache
+    import etag
+    import pagination
+    import token_cache
+    from models import Todo, User
+    from router import auth
+
+    return {
+        "jsonable_encoder": jsonable_encoder,
+        "jwt": jwt,
+        "cache": cache,
+        "etag": etag,
+        "pagination": pagination,
+        "token_cache": token_cache,
+        "Todo": Todo,
+        "User": User,
+        "auth": auth,
+    }
+
+
+def benchmarks(modules: dict) -> dict:
+    """Name -> zero argument callable of every benchmark"""
+    auth = modules["auth"]
+    jwt = modules["jwt"]
+    todo_model = modules["Todo"]
+    user = modules["User"](id=1, username="bench", role="user")
+    token = auth.generate_token(user, timedelta(minutes=60))
+    todos = [
+        todo_model(
+            id=number,
+            title=f"todo {number}",
+            description="micro benchmark todo",
+            priority=number % 5 + 1,
+            is_complete=False,
+            owner_id=1,
+            category="benchmark",
+            todo_type="task",
+            version=1,
+        )
+        for number in range(100)
+    ]
+    cache_backend = modules["cache"].MemoryCacheBackend(1000, 60)
+    page = modules["jsonable_encoder"](todos)
+    asyncio.run(cache_backend.set("todos:1", "page", page, 0))
+    token_cache = modules["token_cache"].TokenCache(1000)
+    token_cache.put(
+        token,
+        jwt.decode(
+            token,
+            key=auth.JWT_KEY,
+            algorithms=[auth.JWT_SIGN_ALG],
+            audience="todomanager",
+        ),
+    )
+    cursor = modules["pagination"].encode_cursor("id", [1, 100])
+    loop = asyncio.new_event_loop()
+
+    return {
+        "jwt.decode": lambda: jwt.decode(
+            token,
+            key=auth.JWT_KEY,
+            algorithms=[auth.JWT_SIGN_ALG],
+            audience="todomanager",
+        ),
+        "token_cache.get (hit)": lambda: token_cache.get(token),
+        "jsonable_encoder (100 todos)": lambda: modules["jsonable_encoder"](todos),
+        "todo_cache.get (hit)": lambda: loop.run_until_complete(
+            cache_backend.get("todos:1", "page")
+        ),
+        "encode_cursor": lambda: modules["pagination"].encode_cursor("id", [1, 100]),
+        "decode_cursor": lambda: modules["pagination"].decode_cursor(cursor, "id"),
+        "etag_matches": lambda: modules["etag"].etag_matches(
+            '"todos-1-41", "todos-1-42"', '"todos-1-42"'
+        ),
+    }
+
+
+def main():
+    """Run every benchmark and report the best time per call"""
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", help="write the results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    for name, func in benchmarks(load_app_modules()).items():
+        timer = timeit.Timer(func)
+        number, _ = timer.autorange()
+        best = min(timer.repeat(repeat=args.repeat, number=number)) / number
+        results[name] = {"us_per_call": best * 1e6}
+        print(f"{name:<32}{best * 1e6:>12.2f} us")
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({"results": results}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Read-through cache for todo reads
+"""
+
+import importlib
+import json
+import os
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from time import monotonic
+
+# Todo reads are cached per owner under two namespaces:
+#   todos:<owner_id>  every list page of the owner (any filters, sort or cursor)
+#   todo:<owner_id>   single todos of the owner, keyed by todo id
+# A write drops the owner's list pages and the entries of the todos it touched.
+#
+# Every namespace has a version that is bumped on invalidation. Readers take the version
+# before querying the database and pass it to set(), which ignores the value when the
+# version has moved on. A read that raced with a write can therefore never put the old rows
+# back into the cache after the write has invalidated it.
+# Writers must invalidate after their commit, otherwise a read between the invalidation and
+# the commit could cache the old rows under the new version.
+
+TODO_CACHE_ENABLED = os.environ.get("TODO_CACHE_ENABLED", "true").lower() == "true"
+
+# "memory" or the dotted path of a CacheBackend subclass, e.g. "mycache:RedisCacheBackend"
+TODO_CACHE_BACKEND = os.environ.get("TODO_CACHE_BACKEND", "memory")
+
+TODO_CACHE_SIZE = int(os.environ.get("TODO_CACHE_SIZE", 10000))
+
+TODO_CACHE_TTL = float(os.environ.get("TODO_CACHE_TTL", 30))
+
+
+class CacheBackend(ABC):
+    """
+    Interface of a todo cache backend. Values are JSON compatible.
+    Implement this for an external store shared across workers.
+    """
+
+    @abstractmethod
+    async def version(self, namespace: str) -> int:
+        """Current version of namespace"""
+
+    @abstractmethod
+    async def get(self, namespace: str, key: str):
+        """Cached value or None"""
+
+    @abstractmethod
+    async def set(self, namespace: str, key: str, value, version: int):
+        """Cache value unless namespace has been invalidated since version was read"""
+
+    @abstractmethod
+    async def invalidate(self, namespace: str, key: str | None = None):
+        """Drop a key, or the whole namespace when key is None, and bump the version"""
+
+    @abstractmethod
+    def stats(self) -> dict:
+        """Hit ratio and size metrics"""
+
+
+class MemoryCacheBackend(CacheBackend):
+    """
+    In-process LRU cache with a TTL per entry
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries: OrderedDict[tuple[str, str], tuple[float, object, int]] = (
+            OrderedDict()
+        )
+        self.namespaces: dict[str, set[str]] = {}
+        self.versions: dict[str, int] = {}
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def remove(self, entry_key: tuple[str, str]):
+        """Remove an entry, the lock must be held"""
+        _, _, size = self.entries.pop(entry_key)
+        self.size_bytes -= size
+        keys = self.namespaces[entry_key[0]]
+        keys.discard(entry_key[1])
+        if not keys:
+            del self.namespaces[entry_key[0]]
+
+    async def version(self, namespace: str) -> int:
+        with self.lock:
+            return self.versions.get(namespace, 0)
+
+    async def get(self, namespace: str, key: str):
+        entry_key = (namespace, key)
+        with self.lock:
+            entry = self.entries.get(entry_key)
+            if entry is not None and entry[0] <= monotonic():
+                self.remove(entry_key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(entry_key)
+            self.hits += 1
+            return entry[1]
+
+    async def set(self, namespace: str, key: str, value, version: int):
+        if self.max_size <= 0:
+            return
+        # approximate memory use by the size of the encoded value
+        size = len(json.dumps(value, separators=(",", ":")))
+        entry_key = (namespace, key)
+        with self.lock:
+            if self.versions.get(namespace, 0) != version:
+                return
+            if entry_key in self.entries:
+                self.remove(entry_key)
+            self.entries[entry_key] = (monotonic() + self.ttl, value, size)
+            self.namespaces.setdefault(namespace, set()).add(key)
+            self.size_bytes += size
+            while len(self.entries) > self.max_size:
+                self.remove(next(iter(self.entries)))
+                self.evictions += 1
+
+    async def invalidate(self, namespace: str, key: str | None = None):
+        with self.lock:
+            self.versions[namespace] = self.versions.get(namespace, 0) + 1
+            keys = (
+                [key] if key is not None else list(self.namespaces.get(namespace, ()))
+            )
+            for entry_key in [(namespace, key) for key in keys]:
+                if entry_key in self.entries:
+                    self.remove(entry_key)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "memory",
+                "entries": len(self.entries),
+                "max_entries": self.max_size,
+                "size_bytes": self.size_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+
+def load_backend() -> CacheBackend:
+    """
+    Create the backend configured by TODO_CACHE_BACKEND
+    """
+    if TODO_CACHE_BACKEND == "memory":
+        return MemoryCacheBackend(TODO_CACHE_SIZE, TODO_CACHE_TTL)
+    module_name, class_name = TODO_CACHE_BACKEND.split(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+todo_cache = load_backend() if TODO_CACHE_ENABLED else None
+
+
+def list_namespace(owner_id: int) -> str:
+    """Namespace of the list pages of owner_id"""
+    return f"todos:{owner_id}"
+
+
+def item_namespace(owner_id: int) -> str:
+    """Namespace of the single todos of owner_id"""
+    return f"todo:{owner_id}"
+
+
+async def read_through(namespace: str, key: str, load):
+    """
+    Return the cached value of key, or await load() and cache its result.
+    None results (e.g. not found) are not cached.
+    """
+    if todo_cache is None:
+        return await load()
+    version = await todo_cache.version(namespace)
+    value = await todo_cache.get(namespace, key)
+    if value is None:
+        value = await load()
+        if value is not None:
+            await todo_cache.set(namespace, key, value, version)
+    return value
+
+
+async def invalidate_todos(owner_id: int, todo_ids=()):
+    """
+    Drop the cached list pages of owner_id and the cached todos in todo_ids.
+    Call after the write has been committed.
+    """
+    if todo_cache is None:
+        return
+    await todo_cache.invalidate(list_namespace(owner_id))
+    for todo_id in todo_ids:
+        await todo_cache.invalidate(item_namespace(owner_id), str(todo_id))
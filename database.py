@@ -1,11 +1,21 @@
 """
 Database initializer and session manager
 """
+
+import asyncio
 import os
 from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
 from sqlalchemy.ext.declarative import declarative_base
 
+from logs import get_logger
+from metrics import instrument_engine
+from pool_metrics import async_pool_metrics, pool_options, sync_pool_metrics
+
+logger = get_logger(__name__)
 
 # create_engine:
 # create_engine is a function from SQLAlchemy that creates an instance of an SQLAlchemy Engine. The engine represents the interface to the database. It's responsible for managing connections, transactions, and the overall communication between your Python application and the database.
@@ -34,21 +44,210 @@ from sqlalchemy.ext.declarative import declarative_base
 
 SQLALCHEMY_DATABASE_URL = os.environ.get("SQLALCHEMY_DATABASE_URL")
 
+# Optional explicit async URL, derived from SQLALCHEMY_DATABASE_URL when not set
+SQLALCHEMY_ASYNC_DATABASE_URL = os.environ.get("SQLALCHEMY_ASYNC_DATABASE_URL")
+
+# Set DB_ASYNC_ENABLED=false to serve requests through the blocking Session instead
+DB_ASYNC_ENABLED = os.environ.get("DB_ASYNC_ENABLED", "true").lower() == "true"
+
+# Sync drivers mapped to their asyncio counterparts
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def get_async_url(url: str):
+    """
+    Convert a sync database url to the matching asyncio driver url
+    """
+    sync_url = make_url(url)
+    async_driver = ASYNC_DRIVERS.get(sync_url.drivername, sync_url.drivername)
+    return sync_url.set(drivername=async_driver)
+
+
+# DB_CREATE_SCHEMA: create missing tables on startup, set to false in production where
+# Alembic owns the schema
+DB_CREATE_SCHEMA = os.environ.get("DB_CREATE_SCHEMA", "true").lower() == "true"
+
+# DB_WARMUP: open the pool's connections and run the first queries before serving
+DB_WARMUP = os.environ.get("DB_WARMUP", "true").lower() == "true"
+
+# The engines are created by init_engines() from the app lifespan, not at import time, so
+# importing the models (tests, Alembic, scripts) never opens a connection.
+# The session factories are created unbound here and bound to the engines on init.
+db_engine = None
+
+SessionLocal = sessionmaker(autoflush=True, autocommit=False)
+
+# create_async_engine / async_sessionmaker:
+# The asyncio versions of the engine and session factory. Queries are awaited so the
+# event loop keeps serving other requests while the database is working.
+# expire_on_commit is disabled because attributes cannot be lazy loaded after a commit
+# without an explicit await.
+async_db_engine = None
 
-db_engine = create_engine(url=SQLALCHEMY_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(autoflush=True, expire_on_commit=False)
+
+
+def init_engines():
+    """
+    Create the database engines and bind the session factories to them.
+    Pool size, overflow, timeout, recycle and pre-ping come from the DB_POOL_* settings in
+    pool_metrics.py, which also records checkout latency and in-use/idle/waiting counts.
+    """
+    global db_engine, async_db_engine  # pylint: disable=global-statement
+
+    db_engine = create_engine(
+        url=SQLALCHEMY_DATABASE_URL,
+        **pool_options(SQLALCHEMY_DATABASE_URL, sync_pool_metrics),
+    )
+    sync_pool_metrics.attach(db_engine)
+    instrument_engine(db_engine)
+    SessionLocal.configure(bind=db_engine)
+
+    if DB_ASYNC_ENABLED:
+        async_url = SQLALCHEMY_ASYNC_DATABASE_URL or get_async_url(
+            SQLALCHEMY_DATABASE_URL
+        )
+        async_db_engine = create_async_engine(
+            url=async_url, **pool_options(async_url, async_pool_metrics, is_async=True)
+        )
+        async_pool_metrics.attach(async_db_engine.sync_engine)
+        instrument_engine(async_db_engine.sync_engine)
+        AsyncSessionLocal.configure(bind=async_db_engine)
+
+
+async def dispose_engines():
+    """
+    Close every pooled connection
+    """
+    if async_db_engine is not None:
+        await async_db_engine.dispose()
+    if db_engine is not None:
+        db_engine.dispose()
+
+
+async def create_schema():
+    """
+    Create missing tables of every imported model
+    """
+    if DB_ASYNC_ENABLED:
+        async with async_db_engine.begin() as connection:
+            await connection.run_sync(Base.metadata.create_all)
+    else:
+        Base.metadata.create_all(db_engine)
+
+
+async def warm_up(statements: list):
+    """
+    Open the pool's connections and run statements once, so the first requests neither
+    wait for connects nor pay for configuring the mappers and compiling the queries.
+    """
+    engine = async_db_engine if DB_ASYNC_ENABLED else db_engine
+    pool_size = engine.pool.size() if isinstance(engine.pool, QueuePool) else 1
+
+    if not DB_ASYNC_ENABLED:
+        connections = [engine.connect() for _ in range(pool_size)]
+        for statement in statements:
+            connections[0].execute(statement)
+        for connection in connections:
+            connection.close()
+        return
+
+    connections = await asyncio.gather(*(engine.connect() for _ in range(pool_size)))
+    try:
+        for statement in statements:
+            await connections[0].execute(statement)
+    finally:
+        for connection in connections:
+            await connection.close()
 
-SessionLocal = sessionmaker(autoflush=True, bind=db_engine, autocommit=False)
 
 Base = declarative_base()
 
 
-def get_db():
+class SyncSessionAdapter:
+    """
+    Expose a sync Session through the awaitable AsyncSession interface so the routers
+    have a single code path. The queries still block the event loop, this only exists
+    to compare the sync path against the async one.
+    """
+
+    def __init__(self, session: Session):
+        self.session = session
+
+    def get_bind(self):
+        """Engine the session runs on"""
+        return self.session.get_bind()
+
+    async def connection(self):
+        """Connection of the current transaction"""
+        return self.session.connection()
+
+    async def execute(self, statement, params=None):
+        """Execute statement"""
+        return self.session.execute(statement, params)
+
+    async def scalar(self, statement, params=None):
+        """Execute statement and return the first column of the first row"""
+        return self.session.scalar(statement, params)
+
+    async def scalars(self, statement, params=None):
+        """Execute statement and return the scalar results"""
+        return self.session.scalars(statement, params)
+
+    async def stream(self, statement, params=None):
+        """Execute statement and return a streaming result"""
+        return SyncStreamAdapter(self.session.execute(statement, params))
+
+    async def commit(self):
+        """Commit the current transaction"""
+        self.session.commit()
+
+    async def rollback(self):
+        """Rollback the current transaction"""
+        self.session.rollback()
+
+    async def close(self):
+        """Close the session"""
+        self.session.close()
+
+
+class SyncStreamAdapter:
+    """
+    Expose a sync Result through the AsyncResult partitions interface
+    """
+
+    def __init__(self, result):
+        self.result = result
+
+    async def partitions(self, size=None):
+        """Yield the rows in lists of at most size rows"""
+        for partition in self.result.partitions(size):
+            yield partition
+
+
+def new_db_session():
+    """
+    Create a new DB Session, an AsyncSession unless DB_ASYNC_ENABLED is false in which
+    case the sync Session is wrapped in SyncSessionAdapter.
+    The caller is responsible for closing it.
+    """
+    if DB_ASYNC_ENABLED:
+        return AsyncSessionLocal()
+    return SyncSessionAdapter(SessionLocal())
+
+
+async def get_db():
     """
     Get DB Session and yeild the db session
     """
+    db = new_db_session()
     try:
-        db = SessionLocal()
         yield db
     finally:
-        print("DB Connection closed")
-        db.close()
+        logger.debug("DB Connection closed")
+        await db.close()
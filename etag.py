@@ -0,0 +1,77 @@
+"""
+ETag helpers for conditional todo requests
+"""
+
+from fastapi import Response, status
+
+# Strong ETags are derived from version counters kept in the database:
+#   a single todo uses its row version (todos.version, bumped on every update)
+#   a list of todos uses the owner's version (users.todos_version, bumped on every write
+#   to any of the owner's todos)
+# Comparing a counter is enough to answer a conditional request, so an unchanged poll is
+# answered with 304 before any todo rows are loaded or serialized.
+
+
+class NotModified(Exception):
+    """
+    Raised when the representation matches the client's If-None-Match
+    """
+
+    def __init__(self, etag: str):
+        super().__init__(etag)
+        self.etag = etag
+
+
+def todo_etag(todo_id: int, version: int) -> str:
+    """ETag of a single todo"""
+    return f'"todo-{todo_id}-{version}"'
+
+
+def todos_etag(owner_id: int, todos_version: int) -> str:
+    """ETag of the todo lists of owner_id"""
+    return f'"todos-{owner_id}-{todos_version}"'
+
+
+def etag_matches(header: str | None, etag: str, weak: bool = True) -> bool:
+    """
+    Check whether etag is listed in an If-None-Match (weak) or If-Match (strong) header
+    """
+    if not header:
+        return False
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return True
+        if candidate.startswith("W/"):
+            if not weak:
+                continue
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def not_modified_response(etag: str) -> Response:
+    """Empty 304 response"""
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+
+def etag_versions(header: str, todo_id: int) -> list[int] | None:
+    """
+    Row versions of todo_id listed in an If-Match header, or None for "*".
+    Weak ETags never match an If-Match.
+    """
+    prefix = f'"todo-{todo_id}-'
+    versions = []
+    for candidate in header.split(","):
+        candidate = candidate.strip()
+        if candidate == "*":
+            return None
+        version = candidate.removeprefix(prefix)[:-1]
+        if (
+            candidate.startswith(prefix)
+            and candidate.endswith('"')
+            and version.isdigit()
+        ):
+            versions.append(int(version))
+    return versions
@@ -0,0 +1,244 @@
+"""
+Todo change events for the Server-Sent Events feed
+"""
+
+import asyncio
+import importlib
+import os
+from abc import ABC, abstractmethod
+from collections import OrderedDict, deque
+from time import time_ns
+
+import orjson
+
+# Every todo write publishes an event for the owner after its commit:
+#   {"type": "created" | "updated", "todos": [<todo>, ...]}
+#   {"type": "deleted", "ids": [<todo id>, ...]}
+#   {"type": "reset"} after an import, too many todos to send one by one
+# Events go through an EventBackend, which gives them an id and delivers them to the hub
+# of every worker (the memory backend only knows the current one). The hub keeps the last
+# EVENTS_REPLAY_SIZE events of each user and pushes new ones to the user's open streams.
+#
+# A stream that reconnects with Last-Event-ID gets the events it missed from the replay
+# buffer. When that id is no longer buffered the stream starts with a {"type": "reset"}
+# event, telling the client to reload its todos.
+# A subscriber that falls EVENTS_QUEUE_SIZE events behind is disconnected rather than
+# buffered without limit, it resumes from its last event id on reconnect.
+
+# "memory" or the dotted path of an EventBackend subclass, e.g. "myevents:RedisEventBackend"
+EVENTS_BACKEND = os.environ.get("EVENTS_BACKEND", "memory")
+
+# events kept per user for Last-Event-ID resumes
+EVENTS_REPLAY_SIZE = int(os.environ.get("EVENTS_REPLAY_SIZE", 100))
+
+# users whose replay buffers are kept, the least recently active are dropped first
+EVENTS_REPLAY_USERS = int(os.environ.get("EVENTS_REPLAY_USERS", 10000))
+
+# events waiting to be sent to a single stream before it is disconnected
+EVENTS_QUEUE_SIZE = int(os.environ.get("EVENTS_QUEUE_SIZE", 100))
+
+# seconds between keep-alive comments on an idle stream
+EVENTS_KEEPALIVE_SECONDS = float(os.environ.get("EVENTS_KEEPALIVE_SECONDS", 15))
+
+
+class EventBackend(ABC):
+    """
+    Interface of an event backend. Implement this for a broker shared across workers,
+    publish() must deliver the event to the hub of every worker, this one included.
+    """
+
+    @abstractmethod
+    async def start(self, deliver):
+        """Start delivering events with deliver(user_id, event_id, data)"""
+
+    @abstractmethod
+    async def stop(self):
+        """Stop delivering events"""
+
+    @abstractmethod
+    async def publish(self, user_id: int, data: str):
+        """Publish the JSON encoded event data of user_id"""
+
+
+class MemoryEventBackend(EventBackend):
+    """
+    Delivers events to the current worker only
+    """
+
+    def __init__(self):
+        # ids of a previous process never match the ids of this one
+        self.prefix = f"{time_ns():x}-"
+        self.sequence = 0
+        self.deliver = None
+
+    async def start(self, deliver):
+        self.deliver = deliver
+
+    async def stop(self):
+        self.deliver = None
+
+    async def publish(self, user_id: int, data: str):
+        if self.deliver is None:
+            return
+        self.sequence += 1
+        self.deliver(user_id, f"{self.prefix}{self.sequence}", data)
+
+
+class Subscription:
+    """
+    Events waiting to be sent to one stream, None marks the end of the stream
+    """
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self.queue: asyncio.Queue[tuple[str, str] | None] = asyncio.Queue()
+        self.closed = False
+
+    def close(self):
+        """End the stream after the queued events"""
+        if not self.closed:
+            self.closed = True
+            self.queue.put_nowait(None)
+
+
+class EventHub:
+    """
+    Per-user replay buffers and open subscriptions of this worker.
+    Only touched from the event loop thread.
+    """
+
+    def __init__(self, backend: EventBackend, replay_size: int, queue_size: int):
+        self.backend = backend
+        self.replay_size = replay_size
+        self.queue_size = queue_size
+        # user id -> last (event id, data) of the user
+        self.replay: OrderedDict[int, deque[tuple[str, str]]] = OrderedDict()
+        self.subscriptions: dict[int, set[Subscription]] = {}
+        self.delivered = 0
+        self.disconnected = 0
+
+    async def start(self):
+        """Start receiving events from the backend"""
+        await self.backend.start(self.deliver)
+
+    async def stop(self):
+        """Stop receiving events and end every open stream"""
+        await self.backend.stop()
+        for subscriptions in self.subscriptions.values():
+            for subscription in subscriptions:
+                subscription.close()
+
+    def deliver(self, user_id: int, event_id: str, data: str):
+        """Buffer an event and push it to the user's subscriptions"""
+        event = (event_id, data)
+        buffer = self.replay.pop(user_id, None)
+        if buffer is None:
+            buffer = deque(maxlen=self.replay_size)
+        buffer.append(event)
+        self.replay[user_id] = buffer
+        while len(self.replay) > EVENTS_REPLAY_USERS:
+            self.replay.popitem(last=False)
+
+        for subscription in self.subscriptions.get(user_id, ()):
+            if subscription.closed:
+                continue
+            if subscription.queue.qsize() >= self.queue_size:
+                subscription.close()
+                self.disconnected += 1
+            else:
+                subscription.queue.put_nowait(event)
+                self.delivered += 1
+
+    def subscribe(self, user_id: int, last_event_id: str | None):
+        """
+        Open a subscription for user_id.
+        Returns it with the buffered events after last_event_id, or with None when
+        last_event_id is no longer buffered.
+        """
+        backlog = []
+        if last_event_id is not None:
+            buffered = list(self.replay.get(user_id, ()))
+            ids = [event_id for event_id, _ in buffered]
+            backlog = None
+            if last_event_id in ids:
+                start = ids.index(last_event_id) + 1
+                backlog = buffered[start:]
+        subscription = Subscription(user_id)
+        self.subscriptions.setdefault(user_id, set()).add(subscription)
+        return subscription, backlog
+
+    def unsubscribe(self, subscription: Subscription):
+        """Remove a subscription when its stream ends"""
+        subscriptions = self.subscriptions.get(subscription.user_id)
+        if subscriptions is not None:
+            subscriptions.discard(subscription)
+            if not subscriptions:
+                del self.subscriptions[subscription.user_id]
+
+    def stats(self) -> dict:
+        """Open streams and delivery counters"""
+        return {
+            "backend": self.backend.__class__.__name__,
+            "users_streaming": len(self.subscriptions),
+            "streams": sum(len(streams) for streams in self.subscriptions.values()),
+            "users_buffered": len(self.replay),
+            "delivered": self.delivered,
+            "disconnected_slow_streams": self.disconnected,
+        }
+
+
+def load_backend() -> EventBackend:
+    """
+    Create the backend configured by EVENTS_BACKEND
+    """
+    if EVENTS_BACKEND == "memory":
+        return MemoryEventBackend()
+    module_name, class_name = EVENTS_BACKEND.split(":")
+    return getattr(importlib.import_module(module_name), class_name)()
+
+
+event_hub = EventHub(load_backend(), EVENTS_REPLAY_SIZE, EVENTS_QUEUE_SIZE)
+
+
+async def publish_event(owner_id: int, event_type: str, **payload):
+    """
+    Publish a todo event to the streams of owner_id.
+    Call after the write has been committed.
+    """
+    data = orjson.dumps({"type": event_type, **payload}).decode()
+    await event_hub.backend.publish(owner_id, data)
+
+
+def format_event(event_id: str | None, data: str) -> str:
+    """Encode an event in the text/event-stream format"""
+    if event_id is None:
+        return f"data: {data}\n\n"
+    return f"id: {event_id}\ndata: {data}\n\n"
+
+
+async def stream_events(user_id: int, last_event_id: str | None):
+    """
+    Yield the events of user_id as text/event-stream chunks until the stream is closed,
+    starting with the ones missed since last_event_id
+    """
+    subscription, backlog = event_hub.subscribe(user_id, last_event_id)
+    try:
+        if backlog is None:
+            yield format_event(None, orjson.dumps({"type": "reset"}).decode())
+        else:
+            for event_id, data in backlog:
+                yield format_event(event_id, data)
+        while True:
+            try:
+                event = await asyncio.wait_for(
+                    subscription.queue.get(), EVENTS_KEEPALIVE_SECONDS
+                )
+            except asyncio.TimeoutError:
+                # keeps proxies from closing the idle connection
+                yield ": keep-alive\n\n"
+                continue
+            if event is None:
+                return
+            yield format_event(*event)
+    finally:
+        event_hub.unsubscribe(subscription)
@@ -0,0 +1,104 @@
+"""
+Bounded worker pool for password hashing
+"""
+
+import asyncio
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
+
+# bcrypt is deliberately slow (~200ms of CPU per hash). Running it inside an async handler
+# blocks the event loop, freezing every other request in the worker for that time.
+# The bcrypt C extension releases the GIL while hashing, so a small thread pool runs hashes
+# in parallel with the event loop.
+# The number of hashes running or waiting is capped so a burst of logins fails fast instead
+# of building an unbounded backlog of requests that will time out anyway.
+
+HASH_POOL_WORKERS = int(
+    os.environ.get("HASH_POOL_WORKERS", min(4, os.cpu_count() or 1))
+)
+
+HASH_POOL_QUEUE_SIZE = int(os.environ.get("HASH_POOL_QUEUE_SIZE", 32))
+
+
+class HashingPoolFull(Exception):
+    """
+    Raised when every worker is busy and the wait queue is full
+    """
+
+
+class HashingPool:
+    """
+    Run hashing functions on a size limited thread pool with a bounded wait queue
+    """
+
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hashing"
+        )
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def timed(self, func, *args):
+        """Run func in the worker thread and record how long it took"""
+        start = perf_counter()
+        try:
+            return func(*args)
+        finally:
+            latency = perf_counter() - start
+            with self.lock:
+                self.completed += 1
+                self.total_latency += latency
+                self.max_latency = max(self.max_latency, latency)
+
+    async def run(self, func, *args):
+        """
+        Run func(*args) on the pool and await its result.
+        Raises HashingPoolFull straight away when the pool and its queue are full.
+        """
+        with self.lock:
+            if self.pending >= self.max_workers + self.max_queue:
+                self.rejected += 1
+                raise HashingPoolFull()
+            self.pending += 1
+        try:
+            future = self.executor.submit(self.timed, func, *args)
+        except BaseException:
+            self.done(None)
+            raise
+        # a cancelled caller leaves its hash running, it stays pending until it is done
+        future.add_done_callback(self.done)
+        return await asyncio.wrap_future(future)
+
+    def done(self, _future):
+        """Release the slot of a finished or cancelled hash"""
+        with self.lock:
+            self.pending -= 1
+
+    def stats(self) -> dict:
+        """Current queue depth and hash latency"""
+        with self.lock:
+            return {
+                "workers": self.max_workers,
+                "max_queue": self.max_queue,
+                "in_flight": min(self.pending, self.max_workers),
+                "queue_depth": max(self.pending - self.max_workers, 0),
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_latency_ms": (
+                    self.total_latency / self.completed * 1000
+                    if self.completed
+                    else 0.0
+                ),
+                "max_latency_ms": self.max_latency * 1000,
+            }
+
+
+hashing_pool = HashingPool(HASH_POOL_WORKERS, HASH_POOL_QUEUE_SIZE)
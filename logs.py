@@ -0,0 +1,198 @@
+"""
+Structured JSON logging off the event loop
+"""
+
+import copy
+import logging
+import os
+import queue
+import re
+import sys
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+from random import random
+from uuid import uuid4
+
+import orjson
+
+# Loggers under "todomanager" (see get_logger) only put their records on a bounded queue,
+# a QueueListener thread formats them as one JSON object per line and writes them to
+# stdout. A request never waits for stdout, and when the queue is full records are dropped
+# and counted instead of blocking.
+#
+# RequestIdMiddleware gives every request a correlation id, taken from its X-Request-ID
+# header or generated, which is returned in the response and added to every record logged
+# while handling it. Debug records are high volume (one per session closed, per request
+# authorized...), with LOG_LEVEL=debug they are kept for LOG_DEBUG_SAMPLE_RATE of the
+# requests, all of a sampled request's debug records together.
+#
+# Extra fields are passed with extra, e.g. logger.info("Todo created", extra={"id": 1}).
+
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "info").upper()
+
+# share of the requests whose debug records are kept
+LOG_DEBUG_SAMPLE_RATE = float(os.environ.get("LOG_DEBUG_SAMPLE_RATE", 0.01))
+
+# records waiting for the listener thread before new ones are dropped
+LOG_QUEUE_SIZE = int(os.environ.get("LOG_QUEUE_SIZE", 10000))
+
+APP_LOGGER = "todomanager"
+
+REQUEST_ID_HEADER = b"x-request-id"
+
+# accepted X-Request-ID values, anything else is replaced by a generated id
+REQUEST_ID_PATTERN = re.compile(r"[A-Za-z0-9._-]{1,64}")
+
+# attributes of every LogRecord, the others come from extra
+RECORD_ATTRIBUTES = set(vars(logging.makeLogRecord({}))) | {"message", "request_id"}
+
+current_request_id: ContextVar[str | None] = ContextVar(
+    "current_request_id", default=None
+)
+
+# whether the debug records of the current request are kept, None outside requests
+debug_sampled: ContextVar[bool | None] = ContextVar("debug_sampled", default=None)
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Logger of a module, e.g. get_logger(__name__)"""
+    return logging.getLogger(f"{APP_LOGGER}.{name}")
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as a single line JSON object
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(
+                timespec="milliseconds"
+            ),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", None),
+        }
+        for key, value in vars(record).items():
+            if key not in RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return orjson.dumps(entry, default=str).decode()
+
+
+class ContextFilter(logging.Filter):
+    """
+    Drops the debug records of unsampled requests and adds the request id.
+    Runs in the thread logging the record, where the request's context variables are set.
+    """
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno <= logging.DEBUG:
+            sampled = debug_sampled.get()
+            if sampled is None:
+                sampled = random() < LOG_DEBUG_SAMPLE_RATE
+            if not sampled:
+                return False
+        record.request_id = current_request_id.get()
+        return True
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that drops records when the queue is full instead of raising, and
+    leaves the formatting to the listener thread
+    """
+
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # only what cannot cross threads is resolved here: the message arguments and
+        # the traceback
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+log_queue: queue.Queue = queue.Queue(maxsize=LOG_QUEUE_SIZE)
+
+queue_handler = DroppingQueueHandler(log_queue)
+queue_handler.addFilter(ContextFilter())
+
+stdout_handler = logging.StreamHandler(sys.stdout)
+stdout_handler.setFormatter(JsonFormatter())
+
+listener = QueueListener(log_queue, stdout_handler)
+
+
+def start_logging():
+    """Route the app loggers through the queue and start the listener thread"""
+    logger = logging.getLogger(APP_LOGGER)
+    logger.setLevel(LOG_LEVEL)
+    logger.propagate = False
+    if queue_handler not in logger.handlers:
+        logger.addHandler(queue_handler)
+    if listener._thread is None:  # pylint: disable=protected-access
+        listener.start()
+
+
+def stop_logging():
+    """Write the queued records and stop the listener thread"""
+    if listener._thread is not None:  # pylint: disable=protected-access
+        listener.stop()
+
+
+def logging_stats() -> dict:
+    """Records waiting to be written and records dropped"""
+    return {"queued": log_queue.qsize(), "dropped": queue_handler.dropped}
+
+
+class RequestIdMiddleware:
+    """
+    ASGI middleware giving every request a correlation id and its debug sampling decision
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_id = None
+        for name, value in scope["headers"]:
+            if name == REQUEST_ID_HEADER:
+                request_id = value.decode("latin-1")
+                break
+        if request_id is None or not REQUEST_ID_PATTERN.fullmatch(request_id):
+            request_id = uuid4().hex
+
+        async def send_with_request_id(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((REQUEST_ID_HEADER, request_id.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        id_token = current_request_id.set(request_id)
+        sampled_token = debug_sampled.set(random() < LOG_DEBUG_SAMPLE_RATE)
+        try:
+            await self.app(scope, receive, send_with_request_id)
+        finally:
+            debug_sampled.reset(sampled_token)
+            current_request_id.reset(id_token)
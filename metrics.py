@@ -0,0 +1,206 @@
+"""
+Per-route request metrics in Prometheus text format
+"""
+
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# Every request is recorded under its route template (e.g. /todos/{todo_id}) so the
+# number of series stays bounded. Requests that match no route share one label.
+#
+# SQL statements are counted through the cursor execute events. The counters of the
+# current request live in a context variable, which follows the request through awaits and
+# into the greenlets SQLAlchemy's asyncio layer runs the driver in.
+#
+# Everything is updated from the event loop thread without locks to keep the overhead per
+# request to a few dict lookups and additions.
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+UNMATCHED_ROUTE = "unmatched"
+
+
+class RequestStats:
+    """
+    SQL statements run by the current request
+    """
+
+    __slots__ = ("query_count", "db_time", "query_started")
+
+    def __init__(self):
+        self.query_count = 0
+        self.db_time = 0.0
+        self.query_started = 0.0
+
+
+current_request_stats: ContextVar[RequestStats | None] = ContextVar(
+    "current_request_stats", default=None
+)
+
+
+class RouteMetrics:
+    """
+    Latency histogram, status codes and SQL accounting of a single route
+    """
+
+    __slots__ = (
+        "buckets",
+        "count",
+        "latency_sum",
+        "statuses",
+        "query_count",
+        "db_time",
+    )
+
+    def __init__(self):
+        # one slot per bucket plus one for +Inf
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.count = 0
+        self.latency_sum = 0.0
+        self.statuses: dict[int, int] = {}
+        self.query_count = 0
+        self.db_time = 0.0
+
+    def observe(self, latency: float, status_code: int, stats: RequestStats):
+        """Record a finished request"""
+        self.buckets[bisect_left(LATENCY_BUCKETS, latency)] += 1
+        self.count += 1
+        self.latency_sum += latency
+        self.statuses[status_code] = self.statuses.get(status_code, 0) + 1
+        self.query_count += stats.query_count
+        self.db_time += stats.db_time
+
+
+routes: dict[tuple[str, str], RouteMetrics] = {}
+
+# seconds spent in each startup phase, e.g. import, engines, schema, warm_up
+startup_timings: dict[str, float] = {}
+
+
+def before_cursor_execute(*_):
+    """before_cursor_execute event"""
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.query_started = perf_counter()
+
+
+def after_cursor_execute(*_):
+    """after_cursor_execute event"""
+    stats = current_request_stats.get()
+    if stats is not None:
+        stats.query_count += 1
+        stats.db_time += perf_counter() - stats.query_started
+
+
+def instrument_engine(engine: Engine):
+    """Count the statements run on engine against the current request"""
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording latency, status and SQL accounting per route template
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request_stats.set(stats)
+        status_code = 500
+        start = perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            latency = perf_counter() - start
+            current_request_stats.reset(token)
+            # the router stores the matched route in the scope
+            route = scope.get("route")
+            key = (scope["method"], route.path if route else UNMATCHED_ROUTE)
+            route_metrics = routes.get(key)
+            if route_metrics is None:
+                route_metrics = routes[key] = RouteMetrics()
+            route_metrics.observe(latency, status_code, stats)
+
+
+def render_metrics() -> str:
+    """
+    Render every route's metrics in the Prometheus text exposition format
+    """
+    lines = [
+        "# HELP http_request_duration_seconds Request latency by route template",
+        "# TYPE http_request_duration_seconds histogram",
+    ]
+    for (method, path), route_metrics in routes.items():
+        labels = f'method="{method}",route="{path}"'
+        cumulative = 0
+        for bound, count in zip(LATENCY_BUCKETS, route_metrics.buckets):
+            cumulative += count
+            lines.append(
+                f'http_request_duration_seconds_bucket{{{labels},le="{bound}"}} {cumulative}'
+            )
+        lines.append(
+            f'http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {route_metrics.count}'
+        )
+        lines.append(
+            f"http_request_duration_seconds_sum{{{labels}}} {route_metrics.latency_sum}"
+        )
+        lines.append(
+            f"http_request_duration_seconds_count{{{labels}}} {route_metrics.count}"
+        )
+
+    lines += [
+        "# HELP http_responses_total Responses by route template and status code",
+        "# TYPE http_responses_total counter",
+    ]
+    for (method, path), route_metrics in routes.items():
+        for status_code, count in route_metrics.statuses.items():
+            lines.append(
+                f'http_responses_total{{method="{method}",route="{path}",'
+                f'status="{status_code}"}} {count}'
+            )
+
+    lines += [
+        "# HELP db_queries_total SQL statements executed by route template",
+        "# TYPE db_queries_total counter",
+    ]
+    for (method, path), route_metrics in routes.items():
+        lines.append(
+            f'db_queries_total{{method="{method}",route="{path}"}} '
+            f"{route_metrics.query_count}"
+        )
+
+    lines += [
+        "# HELP db_query_duration_seconds_total Time spent in SQL by route template",
+        "# TYPE db_query_duration_seconds_total counter",
+    ]
+    for (method, path), route_metrics in routes.items():
+        lines.append(
+            f'db_query_duration_seconds_total{{method="{method}",route="{path}"}} '
+            f"{route_metrics.db_time}"
+        )
+
+    lines += [
+        "# HELP app_startup_seconds Time spent in each startup phase",
+        "# TYPE app_startup_seconds gauge",
+    ]
+    for phase, seconds in startup_timings.items():
+        lines.append(f'app_startup_seconds{{phase="{phase}"}} {seconds}')
+    return "\n".join(lines) + "\n"
@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, Boolean, ForeignKey
-from database import Base, db_engine
+from sqlalchemy import DDL, Column, Integer, String, Boolean, ForeignKey, Index, event
+from database import Base
 
 
 class User(Base):
@@ -18,6 +18,8 @@ class User(Base):
     is_active = Column(Boolean, default=True)
     role = Column(String)
     phone_number = Column(String, nullable=True)
+    # bumped on every write to the user's todos, used for the todo list ETag
+    todos_version = Column(Integer, nullable=False, default=0, server_default="0")
 
 
 class Todo(Base):
@@ -26,6 +28,38 @@ class Todo(Base):
     """
 
     __tablename__ = "todos"
+    __table_args__ = (
+        # keyset pagination and per-user lookups, the included columns make the
+        # ?fields=id,title,is_complete list view an index-only scan on Postgres
+        Index(
+            "ix_todos_owner_id_id",
+            "owner_id",
+            "id",
+            postgresql_include=["title", "is_complete"],
+        ),
+        # completion / priority filters
+        Index(
+            "ix_todos_owner_id_is_complete_priority",
+            "owner_id",
+            "is_complete",
+            "priority",
+        ),
+        # sort=priority pagination
+        Index(
+            "ix_todos_owner_id_priority_id",
+            "owner_id",
+            "priority",
+            "id",
+            postgresql_include=["title", "is_complete"],
+        ),
+        Index("ix_todos_owner_id_category", "owner_id", "category"),
+        Index("ix_todos_owner_id_todo_type", "owner_id", "todo_type"),
+        # completed todos due for the archive, see archive.py
+        Index("ix_todos_completed_at", "completed_at"),
+        # keep the sequence in sqlite_sequence so every shard can start its own id range,
+        # see shards.py
+        {"sqlite_autoincrement": True},
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     title = Column(String)
@@ -35,7 +69,117 @@ class Todo(Base):
     owner_id = Column(Integer, ForeignKey("users.id"))
     category = Column(String, nullable=True)
     todo_type = Column(String, nullable=True)
+    # bumped on every update, used for the todo ETag
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    # unix time the todo was completed, NULL while it is not
+    completed_at = Column(Integer, nullable=True)
 
 
-# create database and tables
-Base.metadata.create_all(db_engine)
+class ArchivedTodo(Base):
+    """
+    Completed todos moved out of todos by the archive job, same columns as Todo,
+    see archive.py
+    """
+
+    __tablename__ = "todos_archive"
+    __table_args__ = (
+        Index("ix_todos_archive_owner_id_id", "owner_id", "id"),
+        Index("ix_todos_archive_owner_id_priority_id", "owner_id", "priority", "id"),
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    title = Column(String)
+    description = Column(String)
+    priority = Column(Integer)
+    is_complete = Column(Boolean, default=False)
+    owner_id = Column(Integer, ForeignKey("users.id"))
+    category = Column(String, nullable=True)
+    todo_type = Column(String, nullable=True)
+    version = Column(Integer, nullable=False, default=1, server_default="1")
+    completed_at = Column(Integer, nullable=True)
+
+
+class TodoStat(Base):
+    """
+    Number of todos per user and value of a todo column (dimension), kept up to date
+    by the todo writes, see todo_stats.py
+    """
+
+    __tablename__ = "todo_stats"
+
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    dimension = Column(String, primary_key=True)
+    value = Column(String, primary_key=True)
+    count = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class TodoImportBatch(Base):
+    """
+    A committed batch of a todo import, makes re-sending the same upload skip it,
+    see todo_import.py
+    """
+
+    __tablename__ = "todo_import_batches"
+
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    import_id = Column(String, primary_key=True)
+    batch = Column(Integer, primary_key=True)
+    # records of the batch, the valid ones inserted and the invalid ones
+    rows = Column(Integer, nullable=False)
+    inserted = Column(Integer, nullable=False)
+    errors = Column(Integer, nullable=False)
+
+
+class ShardAssignment(Base):
+    """
+    Shard of a user moved off its default shard, kept in the primary database,
+    see shards.py
+    """
+
+    __tablename__ = "shard_assignments"
+
+    owner_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    shard = Column(Integer, nullable=False)
+
+
+# Full-text search index (see search.py), raw DDL as neither the tsvector column nor the
+# FTS5 table can be expressed as model columns. Created with the todos table by create_all,
+# the add_todo_search_index migration creates the same objects on existing databases.
+
+# text search configuration of the generated column, queries must use the same one
+SEARCH_LANGUAGE = "english"
+
+POSTGRES_DDL = (
+    "ALTER TABLE todos ADD COLUMN search_vector tsvector GENERATED ALWAYS AS ("
+    f"to_tsvector('{SEARCH_LANGUAGE}', "
+    "coalesce(title, '') || ' ' || coalesce(description, ''))) STORED",
+    "CREATE INDEX ix_todos_search_vector ON todos USING gin (search_vector)",
+)
+
+SQLITE_DDL = (
+    "CREATE VIRTUAL TABLE todos_fts USING fts5("
+    "title, description, content='todos', content_rowid='id')",
+    "CREATE TRIGGER todos_fts_insert AFTER INSERT ON todos BEGIN "
+    "INSERT INTO todos_fts(rowid, title, description) "
+    "VALUES (new.id, new.title, new.description); END",
+    "CREATE TRIGGER todos_fts_delete AFTER DELETE ON todos BEGIN "
+    "INSERT INTO todos_fts(todos_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); END",
+    "CREATE TRIGGER todos_fts_update AFTER UPDATE OF title, description ON todos BEGIN "
+    "INSERT INTO todos_fts(todos_fts, rowid, title, description) "
+    "VALUES ('delete', old.id, old.title, old.description); "
+    "INSERT INTO todos_fts(rowid, title, description) "
+    "VALUES (new.id, new.title, new.description); END",
+)
+
+for ddl in POSTGRES_DDL:
+    event.listen(
+        Todo.__table__, "after_create", DDL(ddl).execute_if(dialect="postgresql")
+    )
+for ddl in SQLITE_DDL:
+    event.listen(Todo.__table__, "after_create", DDL(ddl).execute_if(dialect="sqlite"))
+event.listen(
+    Todo.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS todos_fts").execute_if(dialect="sqlite"),
+)
@@ -0,0 +1,167 @@
+"""
+Keyset (cursor) pagination for todo lists
+"""
+
+import base64
+import heapq
+import json
+from itertools import islice
+from typing import Literal
+
+from fastapi import status
+from starlette.exceptions import HTTPException
+from sqlalchemy import Select, Table, select, tuple_
+
+from models import Todo
+
+# Keyset pagination:
+# Instead of OFFSET (which makes the database walk and discard every skipped row) each page
+# continues from the sort key values, e.g. (owner_id, id), of the last row of the previous
+# page. With an index on those keys the database seeks straight to that position, so every
+# page costs the same no matter how deep into the table it is.
+# The cursor handed to clients is that position encoded as url-safe base64 so they treat it
+# as an opaque token.
+
+DEFAULT_PAGE_LIMIT = 50
+
+MAX_PAGE_LIMIT = 500
+
+# Sort options and the key columns each one orders by. id is always the last key so the
+# order is stable, and every key set is served by one of the (owner_id, ...) indexes.
+SORT_KEYS = {
+    "id": (Todo.owner_id, Todo.id),
+    "priority": (Todo.owner_id, Todo.priority, Todo.id),
+}
+
+SORT_OPTIONS = Literal["id", "-id", "priority", "-priority"]
+
+# Sparse fieldsets: ?fields=id,title,is_complete selects only those columns (plus the sort
+# keys the cursor needs) and returns only those keys. The (owner_id, id) and
+# (owner_id, priority, id) indexes include title and is_complete on Postgres, so that
+# list view is answered by an index-only scan.
+TODO_FIELDS = tuple(column.key for column in Todo.__table__.columns)
+
+
+def encode_cursor(sort: str, values: list) -> str:
+    """
+    Encode the sort key values of a todo row into an opaque cursor
+    """
+    raw = json.dumps([sort, *values], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(
+    cursor: str, sort: str, key_types: tuple[type, ...] | None = None
+) -> list:
+    """
+    Decode an opaque cursor into the sort key values it points at.
+    key_types is the type of every value, integers of the SORT_KEYS of sort by default.
+    """
+    if key_types is None:
+        key_types = (int,) * len(SORT_KEYS[sort.lstrip("-")])
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        cursor_sort, *values = json.loads(base64.urlsafe_b64decode(padded))
+        if cursor_sort != sort or len(values) != len(key_types):
+            raise ValueError("cursor does not match sort")
+        return [key_type(value) for key_type, value in zip(key_types, values)]
+    except (ValueError, TypeError) as exp:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"msg": "Invalid cursor"},
+        ) from exp
+
+
+def parse_fields(fields: str | None) -> list[str] | None:
+    """
+    Validate a comma separated fields parameter against the todo columns.
+    Returns the field names in the order given, None when every field is wanted.
+    """
+    if fields is None:
+        return None
+    names = list(dict.fromkeys(name.strip() for name in fields.split(",")))
+    unknown = [name for name in names if name not in TODO_FIELDS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={
+                "msg": f"Unknown fields: {', '.join(unknown)}",
+                "fields": list(TODO_FIELDS),
+            },
+        )
+    return names
+
+
+def sort_keys(sort: str, table: Table = Todo.__table__) -> list:
+    """Key columns of sort in table, todos or the archive with the same columns"""
+    return [table.c[key.key] for key in SORT_KEYS[sort.lstrip("-")]]
+
+
+def select_todos(
+    fields: list[str] | None, sort: str = "id", table: Table = Todo.__table__
+) -> Select:
+    """
+    Select the todo columns in fields, or all of them, plus the sort keys of sort
+    """
+    if fields is None:
+        return select(*table.columns)
+    keys = [key.key for key in SORT_KEYS[sort.lstrip("-")]]
+    names = fields + [key for key in keys if key not in fields]
+    return select(*(table.c[name] for name in names))
+
+
+def paginate_todos(
+    statement: Select,
+    cursor: str | None,
+    limit: int,
+    sort: str = "id",
+    table: Table = Todo.__table__,
+) -> Select:
+    """
+    Apply keyset ordering, the cursor position and the page limit to a todo select.
+    One extra row is fetched to find out whether there is a next page.
+    """
+    keys = sort_keys(sort, table)
+    descending = sort.startswith("-")
+    if cursor is not None:
+        position = tuple_(*decode_cursor(cursor, sort))
+        statement = statement.where(
+            tuple_(*keys) < position if descending else tuple_(*keys) > position
+        )
+    order_by = [key.desc() for key in keys] if descending else keys
+    return statement.order_by(*order_by).limit(limit + 1)
+
+
+def merge_pages(pages: list[list], limit: int, sort: str = "id") -> list:
+    """
+    Merge the rows fetched by paginate_todos from several sources (tables or shards)
+    into the first limit + 1 rows in sort order, ready for build_page
+    """
+    names = [key.key for key in SORT_KEYS[sort.lstrip("-")]]
+    merged = heapq.merge(
+        *pages,
+        key=lambda todo: tuple(getattr(todo, name) for name in names),
+        reverse=sort.startswith("-"),
+    )
+    return list(islice(merged, limit + 1))
+
+
+def build_page(
+    todos: list, limit: int, sort: str = "id", fields: list[str] | None = None
+) -> dict:
+    """
+    Build the page envelope from the column rows fetched by paginate_todos.
+    Items are plain dicts, ready for the JSON encoder, trimmed to fields when given.
+    """
+    next_cursor = None
+    if len(todos) > limit:
+        todos = todos[:limit]
+        last = todos[-1]
+        next_cursor = encode_cursor(
+            sort, [getattr(last, key.key) for key in SORT_KEYS[sort.lstrip("-")]]
+        )
+    if fields is None:
+        items = [todo._asdict() for todo in todos]
+    else:
+        items = [{name: getattr(todo, name) for name in fields} for todo in todos]
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,188 @@
+"""
+Connection pool configuration and instrumentation
+"""
+
+import os
+import threading
+from time import monotonic, perf_counter
+
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+
+# Pool settings, see https://docs.sqlalchemy.org/en/20/core/pooling.html
+# DB_POOL_SIZE: connections kept open in the pool
+# DB_MAX_OVERFLOW: extra connections opened when the pool is exhausted
+# DB_POOL_TIMEOUT: seconds to wait for a connection before giving up
+# DB_POOL_RECYCLE: seconds after which a connection is replaced, -1 to never recycle
+# DB_POOL_PRE_PING: test connections with a ping on checkout
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 5))
+
+DB_MAX_OVERFLOW = int(os.environ.get("DB_MAX_OVERFLOW", 10))
+
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", 30))
+
+DB_POOL_RECYCLE = int(os.environ.get("DB_POOL_RECYCLE", -1))
+
+DB_POOL_PRE_PING = os.environ.get("DB_POOL_PRE_PING", "false").lower() == "true"
+
+# checkouts held longer than this are reported as possibly leaked sessions
+DB_POOL_LEAK_SECONDS = float(os.environ.get("DB_POOL_LEAK_SECONDS", 30))
+
+
+class PoolMetrics:
+    """
+    Checkout latency, in-use/idle counts and wait-queue depth of a connection pool
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pool = None
+        self.waiting = 0
+        self.max_waiting = 0
+        self.checkouts = 0
+        self.checkins = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.timeouts = 0
+        self.waits = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # checkout time of every connection currently in use
+        self.checked_out: dict[int, float] = {}
+
+    def wait_started(self):
+        """A caller started waiting for a connection"""
+        with self.lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+
+    def wait_finished(self, wait: float, timed_out: bool):
+        """A caller got a connection (or gave up) after wait seconds"""
+        with self.lock:
+            self.waiting -= 1
+            self.waits += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if timed_out:
+                self.timeouts += 1
+
+    def on_connect(self, *_):
+        """pool connect event"""
+        with self.lock:
+            self.connects += 1
+
+    def on_checkout(self, _, connection_record, __):
+        """pool checkout event"""
+        with self.lock:
+            self.checkouts += 1
+            self.checked_out[id(connection_record)] = monotonic()
+
+    def on_checkin(self, _, connection_record):
+        """pool checkin event"""
+        with self.lock:
+            self.checkins += 1
+            self.checked_out.pop(id(connection_record), None)
+
+    def on_invalidate(self, *_):
+        """pool invalidate event"""
+        with self.lock:
+            self.invalidations += 1
+
+    def attach(self, engine: Engine):
+        """Listen to the pool events of engine"""
+        self.pool = engine.pool
+        event.listen(engine, "connect", self.on_connect)
+        event.listen(engine, "checkout", self.on_checkout)
+        event.listen(engine, "checkin", self.on_checkin)
+        event.listen(engine, "invalidate", self.on_invalidate)
+
+    def stats(self) -> dict:
+        """Current pool state and counters"""
+        now = monotonic()
+        with self.lock:
+            held = [
+                now - checked_out_at for checked_out_at in self.checked_out.values()
+            ]
+            stats = {
+                "pool": self.pool.__class__.__name__ if self.pool else None,
+                "in_use": len(held),
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "checkouts": self.checkouts,
+                "checkins": self.checkins,
+                "connects": self.connects,
+                "invalidations": self.invalidations,
+                "timeouts": self.timeouts,
+                "avg_checkout_wait_ms": (
+                    self.total_wait / self.waits * 1000 if self.waits else 0.0
+                ),
+                "max_checkout_wait_ms": self.max_wait * 1000,
+                "longest_checkout_s": max(held, default=0.0),
+                "possibly_leaked": sum(1 for age in held if age > DB_POOL_LEAK_SECONDS),
+            }
+        if isinstance(self.pool, QueuePool):
+            stats.update(
+                size=self.pool.size(),
+                idle=self.pool.checkedin(),
+                overflow=self.pool.overflow(),
+            )
+        return stats
+
+
+def timed_do_get(pool_class):
+    """
+    Subclass pool_class so the time spent waiting for a connection is recorded.
+    There is no pool event fired before a checkout starts, so this wraps the pool's
+    internal _do_get, the call that blocks while the pool is exhausted. Checkouts
+    served by an idle or a new overflow connection do not wait and are not counted.
+    """
+
+    class TimedPool(pool_class):
+        metrics: PoolMetrics = None
+
+        def _do_get(self):
+            # -1 max_overflow never runs out of connections
+            if (
+                self._max_overflow < 0
+                or self.checkedout() < self.size() + self._max_overflow
+            ):
+                return super()._do_get()
+            self.metrics.wait_started()
+            start = perf_counter()
+            timed_out = False
+            try:
+                return super()._do_get()
+            except exc.TimeoutError:
+                timed_out = True
+                raise
+            finally:
+                self.metrics.wait_finished(perf_counter() - start, timed_out)
+
+    TimedPool.__name__ = f"Timed{pool_class.__name__}"
+    return TimedPool
+
+
+def pool_options(url, metrics: PoolMetrics, is_async: bool = False) -> dict:
+    """
+    create_engine keyword arguments for the configured pool.
+    SQLite keeps the pool its dialect picks (single connection or NullPool) and only
+    gets the events.
+    """
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    pool_class = timed_do_get(AsyncAdaptedQueuePool if is_async else QueuePool)
+    pool_class.metrics = metrics
+    return {
+        "poolclass": pool_class,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+sync_pool_metrics = PoolMetrics()
+
+async_pool_metrics = PoolMetrics()
@@ -0,0 +1,229 @@
+"""
+Read replicas and read routing
+"""
+
+import asyncio
+import os
+from time import monotonic
+
+from sqlalchemy import create_engine, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+import database
+from metrics import instrument_engine
+from pool_metrics import PoolMetrics, pool_options
+
+# Read-only handlers take their session from get_read_db (router/auth.py), which sends
+# them to a replica picked round-robin among the healthy ones. Writes, and the reads of
+# a user who wrote in the last REPLICA_STICKY_SECONDS, stay on the primary so users
+# always read their own writes even while the replicas lag behind.
+# Without replicas, or with none healthy, every read goes to the primary.
+#
+# The sticky window is tracked per process, so with several workers it is kept by the
+# worker that served the write. REPLICA_STICKY_SECONDS should be well above the usual
+# replication lag, which also keeps stale rows out of the todo cache.
+#
+# For local testing point SQLALCHEMY_REPLICA_URLS at a second SQLite file (a copy of the
+# primary's): reads outside the sticky window show the replica's rows.
+
+# comma separated replica URLs, in the SQLALCHEMY_DATABASE_URL format
+SQLALCHEMY_REPLICA_URLS = [
+    url.strip()
+    for url in os.environ.get("SQLALCHEMY_REPLICA_URLS", "").split(",")
+    if url.strip()
+]
+
+# seconds a user's reads stay on the primary after a write
+REPLICA_STICKY_SECONDS = float(os.environ.get("REPLICA_STICKY_SECONDS", 5))
+
+# seconds between health checks, and before a check counts as failed
+REPLICA_HEALTH_INTERVAL = float(os.environ.get("REPLICA_HEALTH_INTERVAL", 5))
+
+REPLICA_HEALTH_TIMEOUT = float(os.environ.get("REPLICA_HEALTH_TIMEOUT", 2))
+
+# users tracked in the sticky window before the expired entries are dropped
+STICKY_MAX_USERS = 10000
+
+
+class Replica:
+    """
+    Engines, session factory and health of a single replica
+    """
+
+    def __init__(self, url: str):
+        self.url = url
+        self.pool_metrics = PoolMetrics()
+        self.healthy = False
+        self.last_error = None
+        self.reads = 0
+        self.engine = None
+        self.async_engine = None
+        self.session_factory = None
+
+    def init_engine(self):
+        """Create the replica's engine like database.init_engines does the primary's"""
+        if database.DB_ASYNC_ENABLED:
+            async_url = database.get_async_url(self.url)
+            self.async_engine = create_async_engine(
+                url=async_url,
+                **pool_options(async_url, self.pool_metrics, is_async=True),
+            )
+            self.pool_metrics.attach(self.async_engine.sync_engine)
+            instrument_engine(self.async_engine.sync_engine)
+            self.session_factory = async_sessionmaker(
+                bind=self.async_engine, autoflush=True, expire_on_commit=False
+            )
+        else:
+            self.engine = create_engine(
+                url=self.url, **pool_options(self.url, self.pool_metrics)
+            )
+            self.pool_metrics.attach(self.engine)
+            instrument_engine(self.engine)
+            self.session_factory = sessionmaker(
+                bind=self.engine, autoflush=True, autocommit=False
+            )
+
+    def new_session(self):
+        """New session on the replica, see database.new_db_session"""
+        if database.DB_ASYNC_ENABLED:
+            return self.session_factory()
+        return database.SyncSessionAdapter(self.session_factory())
+
+    def ping(self):
+        """Blocking health check query"""
+        with self.engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+
+    async def check_health(self):
+        """Run a health check query and record the result"""
+        try:
+            if database.DB_ASYNC_ENABLED:
+
+                async def ping():
+                    async with self.async_engine.connect() as connection:
+                        await connection.execute(text("SELECT 1"))
+
+                await asyncio.wait_for(ping(), REPLICA_HEALTH_TIMEOUT)
+            else:
+                await asyncio.wait_for(
+                    asyncio.to_thread(self.ping), REPLICA_HEALTH_TIMEOUT
+                )
+            self.healthy = True
+            self.last_error = None
+        except Exception as exp:  # pylint: disable=broad-exception-caught
+            self.healthy = False
+            self.last_error = repr(exp)
+
+    async def dispose(self):
+        """Close every pooled connection"""
+        if self.async_engine is not None:
+            await self.async_engine.dispose()
+        if self.engine is not None:
+            self.engine.dispose()
+
+    def stats(self) -> dict:
+        """Health, reads served and pool state"""
+        return {
+            "url": make_url(self.url).render_as_string(hide_password=True),
+            "healthy": self.healthy,
+            "last_error": self.last_error,
+            "reads": self.reads,
+            "pool": self.pool_metrics.stats(),
+        }
+
+
+class ReplicaSet:
+    """
+    Round-robin selection among the healthy replicas, periodic health checks and the
+    sticky primary window of recent writers
+    """
+
+    def __init__(self, urls: list[str], sticky_seconds: float):
+        self.replicas = [Replica(url) for url in urls]
+        self.sticky_seconds = sticky_seconds
+        self.next = 0
+        self.primary_reads = 0
+        self.sticky_reads = 0
+        # user id -> end of the user's sticky window
+        self.sticky_until: dict[int, float] = {}
+        self.health_task = None
+
+    async def start(self):
+        """Create the replica engines, check them once and keep checking in the background"""
+        if not self.replicas:
+            return
+        for replica in self.replicas:
+            replica.init_engine()
+        await self.check_health()
+        self.health_task = asyncio.create_task(self.run_health_checks())
+
+    async def stop(self):
+        """Stop the health checks and dispose the engines"""
+        if self.health_task is not None:
+            self.health_task.cancel()
+            self.health_task = None
+        for replica in self.replicas:
+            await replica.dispose()
+
+    async def check_health(self):
+        """Health check every replica concurrently"""
+        await asyncio.gather(*(replica.check_health() for replica in self.replicas))
+
+    async def run_health_checks(self):
+        """Health check every REPLICA_HEALTH_INTERVAL seconds"""
+        while True:
+            await asyncio.sleep(REPLICA_HEALTH_INTERVAL)
+            await self.check_health()
+
+    def choose(self) -> Replica | None:
+        """Next healthy replica in round-robin order, None when there is none"""
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(self.next + offset) % len(self.replicas)]
+            if replica.healthy:
+                self.next = (self.next + offset + 1) % len(self.replicas)
+                return replica
+        return None
+
+    def record_write(self, user_id: int):
+        """Keep the reads of user_id on the primary for the sticky window"""
+        now = monotonic()
+        self.sticky_until[user_id] = now + self.sticky_seconds
+        if len(self.sticky_until) > STICKY_MAX_USERS:
+            self.sticky_until = {
+                key: until for key, until in self.sticky_until.items() if until > now
+            }
+
+    def is_sticky(self, user_id: int | None) -> bool:
+        """Whether user_id wrote within the sticky window"""
+        until = self.sticky_until.get(user_id)
+        return until is not None and until > monotonic()
+
+    def new_read_session(self, user_id: int | None):
+        """
+        Session for a read-only handler of user_id: on a replica unless the user wrote
+        recently or no replica is healthy. The caller is responsible for closing it.
+        """
+        if self.replicas:
+            if self.is_sticky(user_id):
+                self.sticky_reads += 1
+            else:
+                replica = self.choose()
+                if replica is not None:
+                    replica.reads += 1
+                    return replica.new_session()
+        self.primary_reads += 1
+        return database.new_db_session()
+
+    def stats(self) -> dict:
+        """Reads served by the primary (sticky reads included) and every replica"""
+        return {
+            "primary_reads": self.primary_reads,
+            "sticky_reads": self.sticky_reads,
+            "sticky_users": len(self.sticky_until),
+            "replicas": [replica.stats() for replica in self.replicas],
+        }
+
+
+replica_set = ReplicaSet(SQLALCHEMY_REPLICA_URLS, REPLICA_STICKY_SECONDS)
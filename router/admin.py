@@ -2,35 +2,210 @@
 Todo admin APIs
 """
 
-from typing import Annotated
-from fastapi import APIRouter, Depends
-from fastapi.responses import JSONResponse
-from fastapi.encoders import jsonable_encoder
-from sqlalchemy.orm import Session
-
-from models import Todo
-from schemas import TodoCreate
-from database import get_db
+import csv
+import io
+import json
+from itertools import product
+from typing import Annotated, Literal
+from fastapi import APIRouter, Depends, Path, Query
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy import select
+
+from archive import archiver
+from models import ArchivedTodo, Todo
+from pagination import (
+    DEFAULT_PAGE_LIMIT,
+    MAX_PAGE_LIMIT,
+    build_page,
+    merge_pages,
+    paginate_todos,
+    parse_fields,
+    select_todos,
+)
+from schemas import TodoCreate, TodoFieldsPage
+from token_cache import token_cache
+from cache import todo_cache
+from events import event_hub
+from logs import get_logger, logging_stats
+from hashing import hashing_pool
+from pool_metrics import async_pool_metrics, sync_pool_metrics
+from replicas import replica_set
+from shards import shard_map
+from todo_stats import rebuild_stats
 from .auth import get_user_info, authorize_request
 
 router = APIRouter(prefix="/auth", tags=["Admin API"])
 
+logger = get_logger(__name__)
+
 
 UserInfoDependency = Annotated[dict, Depends(get_user_info)]
 
 AuthorizeUserDependency = Annotated[bool, Depends(authorize_request)]
 
-DBDependency = Annotated[Session, Depends(get_db)]
+# Rows fetched from the server side cursor per batch while exporting
+EXPORT_BATCH_SIZE = 1000
+
+EXPORT_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
 
+async def stream_todos(export_format: str, tables: list):
+    """
+    Stream every todo of tables, shard after shard, from a server side cursor, encoded
+    one batch at a time.
+    Uses its own sessions so they stay open until the last batch has been sent.
+    """
+    if export_format == "csv":
+        yield ",".join(Todo.__table__.columns.keys()) + "\r\n"
+    for index, table in product(range(shard_map.count), tables):
+        db = shard_map.new_session(index, read=True)
+        try:
+            result = await db.stream(
+                select(*table.columns)
+                .order_by(table.c.owner_id, table.c.id)
+                .execution_options(yield_per=EXPORT_BATCH_SIZE)
+            )
+            async for rows in result.partitions():
+                buffer = io.StringIO()
+                if export_format == "csv":
+                    csv.writer(buffer).writerows(rows)
+                else:
+                    for row in rows:
+                        buffer.write(json.dumps(dict(row._mapping)) + "\n")
+                yield buffer.getvalue()
+        finally:
+            await db.close()
 
-@router.get("/todos")
+
+@router.get("/todos", response_model=TodoFieldsPage)
 async def get_todos_admin(
-    user: UserInfoDependency, aut: AuthorizeUserDependency, db: DBDependency
+    user: UserInfoDependency,
+    aut: AuthorizeUserDependency,
+    limit: int = Query(default=DEFAULT_PAGE_LIMIT, gt=0, le=MAX_PAGE_LIMIT),
+    cursor: str | None = Query(default=None),
+    fields: str | None = Query(default=None, description="e.g. id,title,is_complete"),
+    include_archived: bool = Query(default=False),
+):
+    """
+    Get Todo admin, paginated by (owner_id, id), optionally only the given fields and
+    with the archived todos.
+    Every shard returns its own next page, merged in (owner_id, id) order.
+    """
+    logger.debug("Admin todo list", extra={"user": user, "authorized": aut})
+    field_names = parse_fields(fields)
+    tables = [Todo.__table__]
+    if include_archived:
+        tables.append(ArchivedTodo.__table__)
+    pages = []
+    for table in tables:
+        pages += await shard_map.fan_out(
+            paginate_todos(
+                select_todos(field_names, table=table), cursor, limit, table=table
+            )
+        )
+    return ORJSONResponse(
+        status_code=200,
+        content=build_page(merge_pages(pages, limit), limit, fields=field_names),
+    )
+
+
+@router.get("/todos/export")
+async def export_todos_admin(
+    _: UserInfoDependency,
+    __: AuthorizeUserDependency,
+    export_format: Literal["ndjson", "csv"] = Query(default="ndjson", alias="format"),
+    include_archived: bool = Query(default=False),
+):
+    """
+    Export all todos as NDJSON or CSV, streamed in batches, with include_archived the
+    archived ones too
+    """
+    tables = [Todo.__table__]
+    if include_archived:
+        tables.append(ArchivedTodo.__table__)
+    return StreamingResponse(
+        stream_todos(export_format, tables),
+        media_type=EXPORT_MEDIA_TYPES[export_format],
+        headers={
+            "Content-Disposition": f'attachment; filename="todos.{export_format}"'
+        },
+    )
+
+
+@router.get("/stats/hashing")
+async def get_hashing_stats(_: UserInfoDependency, __: AuthorizeUserDependency):
+    """Password hashing pool queue depth and latency"""
+    return hashing_pool.stats()
+
+
+@router.get("/stats/db-pool")
+async def get_db_pool_stats(_: UserInfoDependency, __: AuthorizeUserDependency):
+    """Database connection pool checkout latency and connection counts"""
+    return {"sync": sync_pool_metrics.stats(), "async": async_pool_metrics.stats()}
+
+
+@router.get("/stats/events")
+async def get_event_stats(_: UserInfoDependency, __: AuthorizeUserDependency):
+    """Open todo event streams and delivery counters"""
+    return event_hub.stats()
+
+
+@router.get("/stats/logging")
+async def get_logging_stats(_: UserInfoDependency, __: AuthorizeUserDependency):
+    """Log records waiting for the writer thread and records dropped"""
+    return logging_stats()
+
+
+@router.get("/stats/replicas")
+async def get_replica_stats(_: UserInfoDependency, __: AuthorizeUserDependency):
+    """Replica health and reads served by the primary and every replica"""
+    return replica_set.stats()
+
+
+@router.get("/stats/archive")
+async def get_archive_stats(_: UserInfoDependency, __: AuthorizeUserDependency):
+    """Runs of the archive job and todos archived"""
+    return archiver.stats()
+
+
+@router.get("/stats/shards")
+async def get_shard_stats(_: UserInfoDependency, __: AuthorizeUserDependency):
+    """Shard strategy, cached shard lookups and every shard's pool state"""
+    return shard_map.stats()
+
+
+@router.get("/stats/token-cache")
+async def get_token_cache_stats(_: UserInfoDependency, __: AuthorizeUserDependency):
+    """Verified token cache hit and miss counters"""
+    return token_cache.stats()
+
+
+@router.get("/stats/todo-cache")
+async def get_todo_cache_stats(_: UserInfoDependency, __: AuthorizeUserDependency):
+    """Todo read cache hit ratio and memory size"""
+    return todo_cache.stats() if todo_cache is not None else {"backend": None}
+
+
+@router.post("/stats/todos/rebuild")
+async def rebuild_todo_stats(_: UserInfoDependency, __: AuthorizeUserDependency):
+    """Recompute every user's todo stats, archived todos included, shard after shard"""
+    rows = 0
+    for index in range(shard_map.count):
+        db = shard_map.new_session(index)
+        try:
+            rows += await rebuild_stats(db)
+        finally:
+            await db.close()
+    return {"status": "Rebuilt", "rows": rows}
+
+
+@router.delete("/token-cache/users/{user_id}")
+async def invalidate_user_tokens(
+    _: UserInfoDependency, __: AuthorizeUserDependency, user_id: int = Path(gt=0)
 ):
-    """Get Todo admin"""
-    print(user, aut)
-    todos = db.query(Todo).all()
-    return JSONResponse(status_code=200, content=jsonable_encoder(todos))
+    """Drop the cached tokens of a user so they are verified again on next use"""
+    token_cache.invalidate_user(user_id)
+    return {"status": "Invalidated"}
 
 
 @router.post("/todos")
@@ -13,21 +13,28 @@ from fastapi.security import OAuth2PasswordRequestForm, OAuth2PasswordBearer
 
 from starlette import status
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from jose import jwt, JWTError
 
+from hashing import HashingPoolFull, hashing_pool
+from logs import get_logger
 from models import User
 from schemas import UserCreate, AuthResponse
+from token_cache import token_cache
 from database import get_db
+from shards import shard_map
 
 router = APIRouter(
     tags=["Auth APIs"],
     prefix="/auth",
 )
 
+logger = get_logger(__name__)
+
 bcrypt = CryptContext(schemes=["bcrypt"])
 
-DBDependency = Annotated[Session, Depends(get_db)]
+DBDependency = Annotated[AsyncSession, Depends(get_db)]
 
 JWT_KEY = "weneqweqwuhu3hhu32erh3rf32fh"
 
@@ -36,14 +43,28 @@ JWT_SIGN_ALG = "HS256"
 oauth_bearer = OAuth2PasswordBearer(tokenUrl="auth/token")
 
 
-def authenticate_user(username: str, password: str, db):
+async def run_hashing(func, *args):
+    """
+    Run a bcrypt call on the hashing pool, answering 503 when the pool is saturated
+    """
+    try:
+        return await hashing_pool.run(func, *args)
+    except HashingPoolFull as exp:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail={"msg": "Server busy, try again later"},
+            headers={"Retry-After": "1"},
+        ) from exp
+
+
+async def authenticate_user(username: str, password: str, db: AsyncSession):
     """
     authenticate user and check user existence
     """
-    user = db.query(User).filter(User.username == username).first()
+    user = await db.scalar(select(User).where(User.username == username))
     if not user:
         return False
-    if not bcrypt.verify(password, user.hashed_password):
+    if not await run_hashing(bcrypt.verify, password, user.hashed_password):
         return False
     else:
         return user
@@ -74,9 +95,12 @@ async def get_user_info(request: Request, token: Annotated[str, Depends(oauth_be
     Authorize User by decoding jwt token
     """
     try:
-        payload = jwt.decode(
-            token, key=JWT_KEY, algorithms=[JWT_SIGN_ALG], audience="todomanager"
-        )
+        payload = token_cache.get(token)
+        if payload is None:
+            payload = jwt.decode(
+                token, key=JWT_KEY, algorithms=[JWT_SIGN_ALG], audience="todomanager"
+            )
+            token_cache.put(token, payload)
         username: str = payload.get("username")
         role: str = payload.get("role")
         user_id: int = payload.get("id")
@@ -91,18 +115,43 @@ async def get_user_info(request: Request, token: Annotated[str, Depends(oauth_be
             request.state.user_info = user_info
             return user_info
     except JWTError as exp:
-        print(exp)
+        logger.info("Invalid token", extra={"error": str(exp)})
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail={"msg": "Invalid token"}
         ) from exp
 
 
+async def get_owner_db(user: Annotated[dict, Depends(get_user_info)]):
+    """
+    Get DB Session on the shard holding the user's todos
+    """
+    db = await shard_map.owner_session(user.get("id"))
+    try:
+        yield db
+    finally:
+        logger.debug("DB Connection closed")
+        await db.close()
+
+
+async def get_read_db(user: Annotated[dict, Depends(get_user_info)]):
+    """
+    Get DB Session for read-only handlers on the shard holding the user's todos,
+    on a replica of the primary unless the user wrote recently
+    """
+    db = await shard_map.owner_session(user.get("id"), read=True)
+    try:
+        yield db
+    finally:
+        logger.debug("DB Connection closed")
+        await db.close()
+
+
 async def authorize_request(request: Request):
     """
     Authorize request
     """
     user_info = request.state.user_info
-    print("Auth Req", user_info, request.state)
+    logger.debug("Authorizing request", extra={"user": user_info})
     if user_info is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -133,7 +182,7 @@ async def get_token(
     """
     Login User & Get Token
     """
-    user = authenticate_user(form_data.username, form_data.password, db)
+    user = await authenticate_user(form_data.username, form_data.password, db)
 
     if user:
         access_token = generate_token(user, timedelta(minutes=60))
@@ -156,19 +205,22 @@ async def create_user(new_user: UserCreate, db: DBDependency):
     """
     Create user
     """
-    user = User(
-        username=new_user.username,
-        email=new_user.email,
-        first_name=new_user.first_name,
-        last_name=new_user.last_name,
-        role=new_user.role,
-        is_active=True,
-        hashed_password=bcrypt.hash(new_user.password),
+    hashed_password = await run_hashing(bcrypt.hash, new_user.password)
+    user_id = await db.scalar(
+        insert(User)
+        .values(
+            username=new_user.username,
+            email=new_user.email,
+            first_name=new_user.first_name,
+            last_name=new_user.last_name,
+            role=new_user.role,
+            is_active=True,
+            hashed_password=hashed_password,
+        )
+        .returning(User.id)
     )
-
-    db.add(user)
-    db.commit()
-    db.refresh(user)
+    await shard_map.add_user(db, user_id)
+    await db.commit()
 
     return JSONResponse(
         status_code=status.HTTP_201_CREATED, content={"status": "Success"}
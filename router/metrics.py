@@ -0,0 +1,22 @@
+"""
+Metrics routes
+"""
+
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from admission import render_admission_metrics
+from metrics import render_metrics
+
+router = APIRouter(tags=["Metrics API"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Request, database and admission metrics in Prometheus text format
+    """
+    return PlainTextResponse(
+        render_metrics() + render_admission_metrics(),
+        media_type="text/plain; version=0.0.4; charset=utf-8",
+    )
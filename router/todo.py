@@ -2,60 +2,676 @@
 Todo Routes
 """
 
-from typing import Annotated
-from fastapi import Depends, APIRouter, Path, status
-from fastapi.responses import JSONResponse
+import json
+from typing import Annotated, Any
+from uuid import uuid4
+from fastapi import Body, Depends, APIRouter, Header, Path, Query, Request, status
+from fastapi.responses import ORJSONResponse, StreamingResponse
 from fastapi.encoders import jsonable_encoder
 from starlette.exceptions import HTTPException
-from sqlalchemy.orm import Session
-
-from database import get_db
-from models import Todo
-from schemas import TodoCreate
-from .auth import get_user_info
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import bindparam, func, select, delete, insert, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
+from archive import archived_ids, completion_time, delete_archived
+from cache import invalidate_todos, item_namespace, list_namespace, read_through
+from events import publish_event, stream_events
+from logs import get_logger
+from etag import (
+    NotModified,
+    etag_matches,
+    etag_versions,
+    not_modified_response,
+    todo_etag,
+    todos_etag,
+)
+from models import ArchivedTodo, Todo, User
+from pagination import (
+    DEFAULT_PAGE_LIMIT,
+    MAX_PAGE_LIMIT,
+    SORT_OPTIONS,
+    TODO_FIELDS,
+    build_page,
+    merge_pages,
+    paginate_todos,
+    parse_fields,
+    select_todos,
+)
+from replicas import replica_set
+from shards import MOVED, insert_user_row, shard_map
+from schemas import (
+    TodoCreate,
+    TodoBulkUpdate,
+    TodoBulkDelete,
+    TodoFieldsPage,
+    TodoOut,
+    TodoPage,
+)
+from search import build_search_page, check_search_query, search_todos
+from todo_import import (
+    IMPORT_BATCH_SIZE,
+    IMPORT_FORMATS,
+    IMPORT_MAX_REPORTED_ERRORS,
+    committed_batches,
+    import_progress,
+    insert_todos,
+    record_import_batch,
+    record_parser,
+    validate_import_batch,
+)
+from todo_stats import STATS_COLUMNS, apply_stats_delta, get_stats, stats_delta
+from .auth import get_owner_db, get_read_db, get_user_info
 
 router = APIRouter(tags=["Todos API"])
 
-DBDependency = Annotated[Session, Depends(get_db)]
+logger = get_logger(__name__)
+
+DBDependency = Annotated[AsyncSession, Depends(get_owner_db)]
+
+ReadDBDependency = Annotated[AsyncSession, Depends(get_read_db)]
 
 UserInfoDependency = Annotated[dict, Depends(get_user_info)]
 
+# Maximum number of items accepted by a single bulk request
+BULK_MAX_ITEMS = 500
+
+
+def moved_error(owner_id: int) -> HTTPException:
+    """
+    503 for a request that reached the previous shard of owner_id, whose todos have
+    been moved. The cached shard is dropped so the retry goes to the new one.
+    """
+    shard_map.forget(owner_id)
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail={"msg": "Todos are being moved, try again later"},
+        headers={"Retry-After": "1"},
+    )
+
+
+async def bump_todos_version(db: AsyncSession, owner_id: int):
+    """
+    Bump the owner's todo list version (and so the list ETag).
+    Runs in the caller's transaction. Answers 503, rolling the write back, when the
+    owner's todos have been moved to another shard meanwhile.
+    """
+    statement = (
+        update(User)
+        .where(User.id == owner_id)
+        .where(User.todos_version != MOVED)
+        .values(todos_version=User.todos_version + 1)
+        .execution_options(synchronize_session=False)
+    )
+    bumped = await db.execute(statement)
+    if (
+        bumped.rowcount == 0
+        and await shard_map.shard_of(owner_id) != 0
+        and await db.scalar(select(User.id).where(User.id == owner_id)) is None
+    ):
+        # the stub users row of the owner's shard is missing (see shards.py)
+        await db.execute(insert_user_row(db.get_bind().dialect.name, owner_id))
+        bumped = await db.execute(statement)
+    if bumped.rowcount == 0:
+        raise moved_error(owner_id)
+
 
-@router.get("/todos", status_code=status.HTTP_200_OK)
-async def get_todos(user: UserInfoDependency, db: DBDependency):
+def check_bulk_size(items: list):
     """
-    Get Todos
+    Reject empty bulk requests and requests over BULK_MAX_ITEMS
+    """
+    if not 0 < len(items) <= BULK_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"msg": f"Bulk requests take between 1 and {BULK_MAX_ITEMS} items"},
+        )
+
+
+def validate_bulk_items(items: list[dict], schema: type[BaseModel]):
+    """
+    Validate every bulk item on its own so one bad item does not fail the batch.
+    Returns the valid (index, item) pairs and the results of the invalid items.
+    """
+    valid, results = [], []
+    for index, item in enumerate(items):
+        try:
+            valid.append((index, schema.model_validate(item)))
+        except ValidationError as exp:
+            results.append(
+                {
+                    "index": index,
+                    "status": status.HTTP_422_UNPROCESSABLE_ENTITY,
+                    "errors": jsonable_encoder(exp.errors(include_url=False)),
+                }
+            )
+    return valid, results
+
+
+@router.get("/todos", status_code=status.HTTP_200_OK, response_model=TodoFieldsPage)
+async def get_todos(
+    user: UserInfoDependency,
+    db: ReadDBDependency,
+    limit: int = Query(default=DEFAULT_PAGE_LIMIT, gt=0, le=MAX_PAGE_LIMIT),
+    cursor: str | None = Query(default=None),
+    is_complete: bool | None = Query(default=None),
+    priority: int | None = Query(default=None, gt=0, lt=6),
+    category: str | None = Query(default=None),
+    todo_type: str | None = Query(default=None),
+    sort: SORT_OPTIONS = Query(default="id"),
+    fields: str | None = Query(default=None, description="e.g. id,title,is_complete"),
+    include_archived: bool = Query(default=False),
+    if_none_match: str | None = Header(default=None),
+):
+    """
+    Get Todos, one page at a time ordered by sort (id or priority, prefix with - for
+    descending) and optionally filtered.
+    Pass the returned next_cursor to get the following page, and a comma separated list
+    of fields to only get those. Archived todos are only listed with include_archived.
+    Answers 304 when If-None-Match holds the current ETag.
     """
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail={"msg": "Authentication Failed"},
         )
-    return db.query(Todo).filter(Todo.owner_id == user.get("id")).all()
+    filters = {
+        "is_complete": is_complete,
+        "priority": priority,
+        "category": category,
+        "todo_type": todo_type,
+    }
 
+    owner_id = user.get("id")
+    field_names = parse_fields(fields)
 
-@router.get("/todos/{todo_id}")
-async def get_todo_by_id(
-    user: UserInfoDependency, db: DBDependency, todo_id: int = Path(gt=0)
+    async def load_page():
+        # read the version before the rows, so the ETag is never newer than the page
+        todos_version = await db.scalar(
+            select(User.todos_version).where(User.id == owner_id)
+        )
+        if todos_version == MOVED:
+            # never cache the empty page of a stale shard
+            raise moved_error(owner_id)
+        etag = todos_etag(owner_id, todos_version)
+        if etag_matches(if_none_match, etag):
+            raise NotModified(etag)
+
+        def page_statement(table):
+            statement = select_todos(field_names, sort, table).where(
+                table.c.owner_id == owner_id
+            )
+            for name, value in filters.items():
+                if value is not None:
+                    statement = statement.where(table.c[name] == value)
+            return paginate_todos(statement, cursor, limit, sort, table)
+
+        todos = (await db.execute(page_statement(Todo.__table__))).all()
+        # the archive only holds completed todos
+        if include_archived and is_complete is not False:
+            archived = await db.execute(page_statement(ArchivedTodo.__table__))
+            todos = merge_pages([todos, archived.all()], limit, sort)
+        return {
+            "etag": etag,
+            "page": build_page(todos, limit, sort, field_names),
+        }
+
+    cache_key = json.dumps(
+        [limit, cursor, *filters.values(), sort, field_names, include_archived]
+    )
+    try:
+        entry = await read_through(list_namespace(owner_id), cache_key, load_page)
+    except NotModified as exp:
+        return not_modified_response(exp.etag)
+    if etag_matches(if_none_match, entry["etag"]):
+        return not_modified_response(entry["etag"])
+    return ORJSONResponse(
+        status_code=status.HTTP_200_OK,
+        content=entry["page"],
+        headers={"ETag": entry["etag"]},
+    )
+
+
+@router.get("/todos/search", status_code=status.HTTP_200_OK, response_model=TodoPage)
+async def search_user_todos(
+    user: UserInfoDependency,
+    db: ReadDBDependency,
+    q: str = Query(min_length=1, max_length=200),
+    limit: int = Query(default=DEFAULT_PAGE_LIMIT, gt=0, le=MAX_PAGE_LIMIT),
+    cursor: str | None = Query(default=None),
 ):
     """
-    Get Todo By ID
+    Search Todos by the words in their title and description, best match first.
+    Pass the returned next_cursor to get the following page.
     """
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail={"msg": "Authentication Failed"},
         )
-    todo = (
-        db.query(Todo)
-        .filter(Todo.id == todo_id)
-        .filter(Todo.owner_id == user.get("id"))
-        .first()
+    check_search_query(q)
+    statement = search_todos(
+        db.get_bind().dialect.name, user.get("id"), q, cursor, limit
+    )
+    rows = await db.execute(statement)
+    return ORJSONResponse(
+        status_code=status.HTTP_200_OK, content=build_search_page(rows.all(), limit)
+    )
+
+
+@router.get("/todos/stats", status_code=status.HTTP_200_OK)
+async def get_todo_stats(user: UserInfoDependency, db: ReadDBDependency):
+    """
+    Get Todo counts, the total and per is_complete, priority, category and todo_type
+    value
+    """
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail={"msg": "Authentication Failed"},
+        )
+    return ORJSONResponse(
+        status_code=status.HTTP_200_OK, content=await get_stats(db, user.get("id"))
+    )
+
+
+@router.get("/todos/stream")
+async def stream_todo_events(
+    user: UserInfoDependency, last_event_id: str | None = Header(default=None)
+):
+    """
+    Stream create, update and delete events of the user's todos as Server-Sent Events.
+    Reconnect with Last-Event-ID to get the events missed in between.
+    """
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail={"msg": "Authentication Failed"},
+        )
+    return StreamingResponse(
+        stream_events(user.get("id"), last_event_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.post("/todos/import", status_code=status.HTTP_200_OK)
+async def import_todos(
+    user: UserInfoDependency,
+    db: DBDependency,
+    request: Request,
+    import_format: IMPORT_FORMATS = Query(default="ndjson", alias="format"),
+    import_id: str | None = Query(default=None, min_length=1, max_length=64),
+):
+    """
+    Import todos from an NDJSON or CSV (with a header row) request body, read and
+    inserted in batches while it is uploaded.
+    Send the same upload again with the same import_id to resume an interrupted import,
+    batches already committed are skipped. Progress is at GET /todos/import/{import_id}.
+    """
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail={"msg": "Authentication Failed"},
+        )
+    owner_id = user.get("id")
+    import_id = import_id or uuid4().hex
+    done = await committed_batches(db, owner_id, import_id)
+    summary = {
+        "import_id": import_id,
+        "batches": 0,
+        "skipped_batches": 0,
+        "rows": 0,
+        "inserted": 0,
+        "errors": 0,
+    }
+    row_errors = []
+
+    async def write_batch(batch: list[tuple]):
+        number = summary["batches"]
+        summary["batches"] += 1
+        summary["rows"] += len(batch)
+        if number in done:
+            summary["skipped_batches"] += 1
+            return
+        todos, errors = validate_import_batch(batch, owner_id)
+        try:
+            # first statement of the transaction, the COPY of insert_todos joins it
+            await record_import_batch(
+                db, owner_id, import_id, number, len(batch), len(todos), len(errors)
+            )
+        except IntegrityError:
+            # committed by a concurrent upload of the same import
+            await db.rollback()
+            summary["skipped_batches"] += 1
+            return
+        if todos:
+            await insert_todos(db, todos)
+            await apply_stats_delta(db, owner_id, stats_delta(todos))
+            await bump_todos_version(db, owner_id)
+        await db.commit()
+        summary["inserted"] += len(todos)
+        summary["errors"] += len(errors)
+        row_errors.extend(errors[: IMPORT_MAX_REPORTED_ERRORS - len(row_errors)])
+        if todos:
+            await invalidate_todos(owner_id)
+            replica_set.record_write(owner_id)
+
+    batch = []
+    async for record in record_parser(import_format)(request.stream()):
+        batch.append(record)
+        if len(batch) == IMPORT_BATCH_SIZE:
+            await write_batch(batch)
+            batch = []
+    if batch:
+        await write_batch(batch)
+
+    if summary["inserted"]:
+        # a single reset instead of an event per imported todo
+        await publish_event(owner_id, "reset")
+    return ORJSONResponse(
+        status_code=status.HTTP_200_OK, content={**summary, "row_errors": row_errors}
+    )
+
+
+@router.get("/todos/import/{import_id}", status_code=status.HTTP_200_OK)
+async def get_import_progress(
+    user: UserInfoDependency,
+    db: DBDependency,
+    import_id: str = Path(min_length=1, max_length=64),
+):
+    """
+    Get the batches, rows, inserted todos and row errors an import has committed so far
+    """
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail={"msg": "Authentication Failed"},
+        )
+    return ORJSONResponse(
+        status_code=status.HTTP_200_OK,
+        content=await import_progress(db, user.get("id"), import_id),
     )
-    if todo is not None:
-        return JSONResponse(
-            status_code=status.HTTP_200_OK, content=jsonable_encoder(todo)
+
+
+@router.post("/todos/bulk")
+async def create_todos_bulk(
+    user: UserInfoDependency,
+    db: DBDependency,
+    items: Annotated[list[dict[str, Any]], Body()],
+):
+    """
+    Create many todo items in a single transaction.
+    Returns a result per item, in the order they were sent.
+    """
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail={"msg": "Authentication Failed"},
+        )
+    check_bulk_size(items)
+    valid, results = validate_bulk_items(items, TodoCreate)
+
+    if valid:
+        todos = [
+            {
+                **todo.model_dump(),
+                "owner_id": user.get("id"),
+                "completed_at": completion_time(todo.is_complete),
+            }
+            for _, todo in valid
+        ]
+        created = (
+            await db.execute(
+                insert(Todo).returning(
+                    *Todo.__table__.columns, sort_by_parameter_order=True
+                ),
+                todos,
+            )
+        ).all()
+        for (index, _), todo in zip(valid, created):
+            results.append(
+                {"index": index, "status": status.HTTP_201_CREATED, "id": todo.id}
+            )
+        await apply_stats_delta(db, user.get("id"), stats_delta(todos))
+        await bump_todos_version(db, user.get("id"))
+        await db.commit()
+        await invalidate_todos(user.get("id"))
+        replica_set.record_write(user.get("id"))
+        await publish_event(
+            user.get("id"), "created", todos=[todo._asdict() for todo in created]
+        )
+
+    results.sort(key=lambda result: result["index"])
+    return {"results": results}
+
+
+@router.put("/todos/bulk")
+async def update_todos_bulk(
+    user: UserInfoDependency,
+    db: DBDependency,
+    items: Annotated[list[dict[str, Any]], Body()],
+):
+    """
+    Update many todo items in a single transaction.
+    Returns a result per item, in the order they were sent.
+    """
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail={"msg": "Authentication Failed"},
+        )
+    check_bulk_size(items)
+    valid, results = validate_bulk_items(items, TodoBulkUpdate)
+
+    # only todos owned by the user can be updated, their current values are locked
+    # until the commit for the stats delta
+    owned = {}
+    if valid:
+        owned = {
+            todo.id: todo._mapping
+            for todo in await db.execute(
+                select(Todo.id, Todo.priority, Todo.is_complete, Todo.completed_at)
+                .where(Todo.id.in_([todo.id for _, todo in valid]))
+                .where(Todo.owner_id == user.get("id"))
+                .with_for_update()
+            )
+        }
+
+    missing = {todo.id for _, todo in valid} - set(owned)
+    archived = await archived_ids(db, user.get("id"), missing) if missing else set()
+
+    rows = []
+    for index, todo in valid:
+        if todo.id in archived:
+            results.append(
+                {
+                    "index": index,
+                    "status": status.HTTP_409_CONFLICT,
+                    "id": todo.id,
+                    "error": f"Todo with {todo.id} is archived and cannot be updated",
+                }
+            )
+            continue
+        if todo.id not in owned:
+            results.append(
+                {
+                    "index": index,
+                    "status": status.HTTP_404_NOT_FOUND,
+                    "id": todo.id,
+                    "error": f"Todo with {todo.id} not found",
+                }
+            )
+            continue
+        rows.append(
+            {
+                "todo_id": todo.id,
+                "description": todo.description,
+                "title": todo.title,
+                "priority": todo.priority,
+                "is_complete": todo.is_complete,
+                "completed_at": (
+                    owned[todo.id].completed_at or completion_time(True)
+                    if todo.is_complete
+                    else None
+                ),
+            }
+        )
+        results.append({"index": index, "status": status.HTTP_200_OK, "id": todo.id})
+
+    if rows:
+        # one UPDATE sent as a single executemany, the SET values come from each row
+        todos_table = Todo.__table__
+        await db.execute(
+            update(todos_table)
+            .where(todos_table.c.id == bindparam("todo_id"))
+            .where(todos_table.c.owner_id == user.get("id"))
+            .values(version=todos_table.c.version + 1),
+            rows,
+        )
+        # the last item wins when an id is sent more than once
+        updated = {row["todo_id"]: row for row in rows}
+        await apply_stats_delta(
+            db,
+            user.get("id"),
+            stats_delta(updated.values(), [owned[todo_id] for todo_id in updated]),
+        )
+        await bump_todos_version(db, user.get("id"))
+        await db.commit()
+        await invalidate_todos(user.get("id"), [row["todo_id"] for row in rows])
+        replica_set.record_write(user.get("id"))
+        # the executemany UPDATE cannot return rows, the event needs one more SELECT
+        todos = await db.execute(
+            select(*Todo.__table__.columns).where(Todo.id.in_(updated))
+        )
+        await publish_event(
+            user.get("id"), "updated", todos=[todo._asdict() for todo in todos]
+        )
+
+    results.sort(key=lambda result: result["index"])
+    return {"results": results}
+
+
+@router.delete("/todos/bulk")
+async def delete_todos_bulk(
+    user: UserInfoDependency, db: DBDependency, todo_request: TodoBulkDelete
+):
+    """
+    Delete many todo items, archived ones included, with a single statement per table.
+    Returns a result per id, in the order they were sent.
+    """
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail={"msg": "Authentication Failed"},
+        )
+    check_bulk_size(todo_request.ids)
+
+    deleted = (
+        await db.execute(
+            delete(Todo)
+            .where(Todo.id.in_(todo_request.ids))
+            .where(Todo.owner_id == user.get("id"))
+            .returning(Todo.id, *STATS_COLUMNS)
+            .execution_options(synchronize_session=False)
+        )
+    ).all()
+    # the ids not in todos may be archived todos
+    missing = set(todo_request.ids) - {todo.id for todo in deleted}
+    if missing:
+        deleted += await delete_archived(db, user.get("id"), missing)
+    deleted_ids = {todo.id for todo in deleted}
+    if deleted:
+        await apply_stats_delta(
+            db,
+            user.get("id"),
+            stats_delta(removed=[todo._mapping for todo in deleted]),
+        )
+        await bump_todos_version(db, user.get("id"))
+    await db.commit()
+    await invalidate_todos(user.get("id"), deleted_ids)
+    replica_set.record_write(user.get("id"))
+    if deleted_ids:
+        await publish_event(user.get("id"), "deleted", ids=sorted(deleted_ids))
+
+    results = []
+    for index, todo_id in enumerate(todo_request.ids):
+        if todo_id in deleted_ids:
+            results.append(
+                {"index": index, "status": status.HTTP_200_OK, "id": todo_id}
+            )
+        else:
+            results.append(
+                {
+                    "index": index,
+                    "status": status.HTTP_404_NOT_FOUND,
+                    "id": todo_id,
+                    "error": f"Todo with {todo_id} not found",
+                }
+            )
+    return {"results": results}
+
+
+@router.get("/todos/{todo_id}", response_model=TodoOut)
+async def get_todo_by_id(
+    user: UserInfoDependency,
+    db: ReadDBDependency,
+    todo_id: int = Path(gt=0),
+    include_archived: bool = Query(default=False),
+    if_none_match: str | None = Header(default=None),
+):
+    """
+    Get Todo By ID, an archived one only with include_archived
+    Answers 304 when If-None-Match holds the current ETag.
+    """
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail={"msg": "Authentication Failed"},
+        )
+
+    async def load_todo():
+        archived = False
+        for table in (Todo.__table__, ArchivedTodo.__table__):
+            todo = (
+                await db.execute(
+                    select(*table.columns)
+                    .where(table.c.id == todo_id)
+                    .where(table.c.owner_id == user.get("id"))
+                )
+            ).first()
+            if todo is not None or not include_archived:
+                break
+            archived = True
+        if todo is None:
+            if (
+                await db.scalar(
+                    select(User.todos_version).where(User.id == user.get("id"))
+                )
+                == MOVED
+            ):
+                raise moved_error(user.get("id"))
+            return None
+        etag = todo_etag(todo.id, todo.version)
+        if etag_matches(if_none_match, etag):
+            raise NotModified(etag)
+        return {"etag": etag, "todo": todo._asdict(), "archived": archived}
+
+    try:
+        entry = await read_through(
+            item_namespace(user.get("id")), str(todo_id), load_todo
+        )
+    except NotModified as exp:
+        return not_modified_response(exp.etag)
+    # cached by a read with include_archived
+    if entry is not None and entry["archived"] and not include_archived:
+        entry = None
+    if entry is not None:
+        if etag_matches(if_none_match, entry["etag"]):
+            return not_modified_response(entry["etag"])
+        return ORJSONResponse(
+            status_code=status.HTTP_200_OK,
+            content=entry["todo"],
+            headers={"ETag": entry["etag"]},
         )
     raise HTTPException(
         status_code=status.HTTP_404_NOT_FOUND,
@@ -63,7 +679,7 @@ async def get_todo_by_id(
     )
 
 
-@router.post("/todos")
+@router.post("/todos", status_code=status.HTTP_201_CREATED, response_model=TodoOut)
 async def create_todo(
     user: UserInfoDependency, db: DBDependency, todo_request: TodoCreate
 ):
@@ -75,16 +691,30 @@ async def create_todo(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail={"msg": "Authentication Failed"},
         )
-    print(user)
-    todo = Todo(**todo_request.model_dump(), owner_id=user.get("id"))
-
-    db.add(todo)
-    db.commit()
-    db.refresh(todo)
+    logger.debug("Creating todo", extra={"user_id": user.get("id")})
+    # single INSERT ... RETURNING instead of INSERT, COMMIT and a refresh SELECT
+    todo = (
+        await db.execute(
+            insert(Todo)
+            .values(
+                **todo_request.model_dump(),
+                owner_id=user.get("id"),
+                completed_at=completion_time(todo_request.is_complete),
+            )
+            .returning(*Todo.__table__.columns)
+        )
+    ).one()
+    await apply_stats_delta(db, user.get("id"), stats_delta([todo._mapping]))
+    await bump_todos_version(db, user.get("id"))
+    await db.commit()
+    await invalidate_todos(user.get("id"))
+    replica_set.record_write(user.get("id"))
+    await publish_event(user.get("id"), "created", todos=[todo._asdict()])
 
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=201,
-        content=jsonable_encoder(todo),
+        content=todo._asdict(),
+        headers={"ETag": todo_etag(todo.id, todo.version)},
     )
 
 
@@ -94,39 +724,119 @@ async def update_todo(
     db: DBDependency,
     todo_request: TodoCreate,
     todo_id: int = Path(gt=0),
+    if_match: str | None = Header(default=None),
 ):
     """
     Update todo item
+    With If-Match the update only happens when it holds the current ETag, otherwise 412.
+    Archived todos cannot be updated, 409.
     """
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail={"msg": "Authentication Failed"},
         )
-    # get todo by id
-    todo = (
-        db.query(Todo)
-        .filter(Todo.id == todo_id)
-        .filter(Todo.owner_id == user.get("id"))
-        .first()
+    statement = (
+        update(Todo)
+        .where(Todo.owner_id == user.get("id"))
+        .values(
+            description=todo_request.description,
+            title=todo_request.title,
+            priority=todo_request.priority,
+            is_complete=todo_request.is_complete,
+            completed_at=(
+                func.coalesce(Todo.completed_at, completion_time(True))
+                if todo_request.is_complete
+                else None
+            ),
+            version=Todo.version + 1,
+        )
+        .returning(*Todo.__table__.columns)
+        .execution_options(synchronize_session=False)
     )
+    versions = etag_versions(if_match, todo_id) if if_match is not None else None
+    if versions is not None:
+        statement = statement.where(Todo.version.in_(versions))
+
+    if db.get_bind().dialect.name == "postgresql":
+        # UPDATE ... FROM (SELECT ... FOR UPDATE) old RETURNING old.*: the row is locked
+        # and its values for the stats delta come back from the UPDATE itself
+        old = (
+            select(Todo.id, Todo.priority, Todo.is_complete)
+            .where(Todo.id == todo_id)
+            .where(Todo.owner_id == user.get("id"))
+            .with_for_update()
+            .subquery("old")
+        )
+        todo = (
+            await db.execute(
+                statement.where(Todo.id == old.c.id).returning(
+                    old.c.priority.label("old_priority"),
+                    old.c.is_complete.label("old_is_complete"),
+                )
+            )
+        ).first()
+        previous = todo and {
+            "priority": todo.old_priority,
+            "is_complete": todo.old_is_complete,
+        }
+    else:
+        # the UPDATE cannot return the old values, read and lock them first
+        previous = (
+            await db.execute(
+                select(Todo.priority, Todo.is_complete)
+                .where(Todo.id == todo_id)
+                .where(Todo.owner_id == user.get("id"))
+                .with_for_update()
+            )
+        ).first()
+        todo = None
+        if previous is not None:
+            previous = previous._mapping
+            todo = (await db.execute(statement.where(Todo.id == todo_id))).first()
 
     if todo is None:
+        # only a failed conditional update needs a second look to tell 412 from 404
+        if versions is not None and await db.scalar(
+            select(Todo.id)
+            .where(Todo.id == todo_id)
+            .where(Todo.owner_id == user.get("id"))
+        ):
+            raise HTTPException(
+                status_code=status.HTTP_412_PRECONDITION_FAILED,
+                detail={"error": f"Todo with {todo_id} has been modified"},
+            )
+        if await archived_ids(db, user.get("id"), [todo_id]):
+            raise HTTPException(
+                status_code=status.HTTP_409_CONFLICT,
+                detail={
+                    "error": f"Todo with {todo_id} is archived and cannot be updated"
+                },
+            )
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail={"error": f"Todo with {todo_id} not found"},
         )
 
-    # Update data
-    todo.description = todo_request.description
-    todo.title = todo_request.title
-    todo.priority = todo_request.priority
-    todo.is_complete = todo_request.is_complete
-
-    db.add(todo)
-    db.commit()
+    await apply_stats_delta(
+        db,
+        user.get("id"),
+        stats_delta(
+            [todo_request.model_dump(include={"priority", "is_complete"})],
+            [previous],
+        ),
+    )
+    await bump_todos_version(db, user.get("id"))
+    await db.commit()
+    await invalidate_todos(user.get("id"), [todo_id])
+    replica_set.record_write(user.get("id"))
+    await publish_event(user.get("id"), "updated", todos=[dict(zip(TODO_FIELDS, todo))])
 
-    return JSONResponse(status_code=200, content={"status": "Updated Todo"})
+    return ORJSONResponse(
+        status_code=200,
+        content={"status": "Updated Todo"},
+        headers={"ETag": todo_etag(todo_id, todo.version)},
+    )
 
 
 @router.delete("/todos/{todo_id}")
@@ -134,31 +844,40 @@ async def delete_todo(
     user: UserInfoDependency, db: DBDependency, todo_id: int = Path(gt=0)
 ):
     """
-    Delete todo item
+    Delete todo item, archived or not
     """
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail={"msg": "Authentication Failed"},
         )
-    todo = (
-        db.query(Todo)
-        .filter(Todo.id == todo_id)
-        .filter(Todo.owner_id == user.get("id"))
-        .first()
-    )
+    # single ownership checked DELETE ... RETURNING, no rows means not found
+    deleted = (
+        await db.execute(
+            delete(Todo)
+            .where(Todo.id == todo_id)
+            .where(Todo.owner_id == user.get("id"))
+            .returning(*STATS_COLUMNS)
+            .execution_options(synchronize_session=False)
+        )
+    ).first()
+    if deleted is None:
+        # only looked for in the archive when it is not in todos
+        deleted = next(iter(await delete_archived(db, user.get("id"), [todo_id])), None)
 
-    if todo is None:
+    if deleted is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail={"error": f"Todo with {todo_id} not found"},
         )
 
-    db.query(Todo).filter(Todo.id == todo_id).filter(
-        Todo.owner_id == user.get("id")
-    ).delete()
-    db.commit()
+    await apply_stats_delta(db, user.get("id"), stats_delta(removed=[deleted._mapping]))
+    await bump_todos_version(db, user.get("id"))
+    await db.commit()
+    await invalidate_todos(user.get("id"), [todo_id])
+    replica_set.record_write(user.get("id"))
+    await publish_event(user.get("id"), "deleted", ids=[todo_id])
 
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=status.HTTP_200_OK, content={"status": "Deleted Successfully"}
     )
@@ -2,7 +2,7 @@
 Pydantic Schemas
 """
 
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 
 
 class TodoCreate(BaseModel):
@@ -18,6 +18,76 @@ class TodoCreate(BaseModel):
     todo_type: str = Field(min_length=2)
 
 
+class TodoBulkUpdate(TodoCreate):
+    """
+    Bulk Update Todo Item Schema
+    """
+
+    id: int = Field(gt=0)
+
+
+class TodoBulkDelete(BaseModel):
+    """
+    Bulk Delete Todo Request Schema
+    """
+
+    ids: list[int] = Field(min_length=1)
+
+
+class TodoOut(BaseModel):
+    """
+    Todo Response Schema
+    """
+
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    title: str
+    description: str
+    priority: int
+    is_complete: bool
+    owner_id: int
+    category: str | None
+    todo_type: str | None
+    version: int
+    completed_at: int | None
+
+
+class TodoPage(BaseModel):
+    """
+    Paginated Todo List Response Schema
+    """
+
+    items: list[TodoOut]
+    next_cursor: str | None
+
+
+class TodoFieldsOut(BaseModel):
+    """
+    Todo Response Schema of lists with ?fields=, only the requested fields are returned
+    """
+
+    id: int = None
+    title: str = None
+    description: str = None
+    priority: int = None
+    is_complete: bool = None
+    owner_id: int = None
+    category: str | None = None
+    todo_type: str | None = None
+    version: int = None
+    completed_at: int | None = None
+
+
+class TodoFieldsPage(BaseModel):
+    """
+    Paginated Todo List Response Schema, with ?fields= the items have only those fields
+    """
+
+    items: list[TodoFieldsOut]
+    next_cursor: str | None
+
+
 class UserCreate(BaseModel):
     """
     Create User Request Schema
@@ -0,0 +1,92 @@
+"""
+Full-text search over todo titles and descriptions
+"""
+
+from fastapi import status
+from starlette.exceptions import HTTPException
+from sqlalchemy import Select, column, func, literal_column, select, table, tuple_
+
+from models import SEARCH_LANGUAGE, Todo
+from pagination import decode_cursor, encode_cursor
+
+# The index lives next to the todos and is maintained by the database itself, so it is in
+# sync after every insert, update and delete, the bulk statements included:
+#   Postgres: todos.search_vector, a generated tsvector column over title and description,
+#   with a GIN index
+#   SQLite: todos_fts, an external content FTS5 table kept up to date by triggers on todos
+# Both are created by the add_todo_search_index migration, and by create_all through the
+# DDL attached to the todos table in models.py.
+#
+# Results are ordered by a score where lower is better (bm25 on SQLite, the negated
+# ts_rank on Postgres) and then by id, and paginated by keyset on (score, id) like the
+# todo lists.
+
+SEARCH_SORT = "search"
+
+todos_fts = table("todos_fts", column("rowid"))
+
+
+def fts5_query(query: str) -> str:
+    """
+    Quote every word of query so FTS5 matches them all as plain terms instead of
+    parsing the query syntax
+    """
+    return " ".join('"' + term.replace('"', '""') + '"' for term in query.split())
+
+
+def search_todos(
+    dialect: str, owner_id: int, query: str, cursor: str | None, limit: int
+) -> Select:
+    """
+    Select the owner's todos matching query, best match first, one page at a time.
+    Rows carry the todo columns plus their score. One extra row is fetched to find out
+    whether there is a next page.
+    """
+    if dialect == "postgresql":
+        tsquery = func.websearch_to_tsquery(SEARCH_LANGUAGE, query)
+        search_vector = literal_column("todos.search_vector")
+        score = -func.ts_rank(search_vector, tsquery)
+        statement = select(*Todo.__table__.columns, score.label("score")).where(
+            search_vector.op("@@")(tsquery)
+        )
+    else:
+        score = func.bm25(literal_column("todos_fts"))
+        statement = select(*Todo.__table__.columns, score.label("score")).join_from(
+            Todo.__table__, todos_fts, todos_fts.c.rowid == Todo.id
+        )
+        statement = statement.where(
+            literal_column("todos_fts").match(fts5_query(query))
+        )
+
+    statement = statement.where(Todo.owner_id == owner_id)
+    if cursor is not None:
+        position = decode_cursor(cursor, SEARCH_SORT, (float, int))
+        statement = statement.where(tuple_(score, Todo.id) > tuple_(*position))
+    return statement.order_by(score, Todo.id).limit(limit + 1)
+
+
+def build_search_page(rows: list, limit: int) -> dict:
+    """
+    Build the page envelope from the rows fetched by search_todos
+    """
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(SEARCH_SORT, [rows[-1].score, rows[-1].id])
+    items = []
+    for row in rows:
+        item = row._asdict()
+        del item["score"]
+        items.append(item)
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def check_search_query(query: str):
+    """
+    Reject queries without a single word
+    """
+    if not query.strip():
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail={"msg": "Search query must contain at least one word"},
+        )
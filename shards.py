@@ -0,0 +1,441 @@
+"""
+Owner-based sharding of the todo tables
+
+Move a user's todos to another shard of the configured databases with:
+
+    python shards.py move <user id> <shard>
+"""
+
+import asyncio
+import os
+import sys
+from time import monotonic
+
+from sqlalchemy import delete, insert, select, text, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+
+import database
+from models import (
+    ArchivedTodo,
+    ShardAssignment,
+    Todo,
+    TodoImportBatch,
+    TodoStat,
+    User,
+)
+from replicas import Replica, replica_set
+
+# Users, and so logins, always live in the primary database. A user's todos, with their
+# archived todos and the todo_stats and todo_import_batches rows of the same owner, live
+# on the user's shard:
+# shard 0 is the primary database, shards 1 to n come from SQLALCHEMY_SHARD_URLS.
+# The todo handlers get their session from get_owner_db / get_read_db (router/auth.py),
+# bound to the shard of the authenticated user. Every todo query is already scoped by
+# owner_id so the handlers run unchanged, admin queries over every user fan out to all
+# the shards and merge the results. Replicas (replicas.py) are replicas of the primary.
+#
+# The shard of a user is the one in shard_assignments (primary database). It is set at
+# signup, by SHARD_STRATEGY, and changed by moves:
+#   range  owner_id // SHARD_RANGE_SIZE, ids past the last range go to the last shard
+#   hash   owner_id % number of shards
+# so adding shards or changing the strategy only affects new users. Users without an
+# assignment, created before shard_assignments was backfilled, are on the primary.
+# Lookups are cached per process for SHARD_MAP_TTL seconds.
+#
+# Every shard has the whole schema. A user whose shard is not the primary gets a stub
+# users row there (same id, only todos_version set), which satisfies the owner foreign
+# keys and keeps the list ETag version in the transaction of the todo writes. It is
+# created before the signup commits, a missing one is created again by the next write
+# or move.
+# Shard n allocates todo ids from n * SHARD_ID_RANGE on, so a user keeps their todo ids
+# when moved. SQLite hands out the id after the largest one in the table whatever its
+# sequence says, so the todos of a higher shard would make a lower one allocate ids of
+# the higher range: on SQLite users are only moved to a higher shard.
+#
+# Moving a user locks their users row on the source shard, so their writes wait, copies
+# the rows, deletes them from the source and sets the source todos_version to MOVED.
+# A write that waited, or came from a worker with a stale cached shard, then bumps no
+# version and is rolled back with 503 (see bump_todos_version in router/todo.py). The
+# cached list and item reads answer the same 503 rather than cache what they find there,
+# other reads from a stale cached shard see no todos for at most SHARD_MAP_TTL seconds.
+# An interrupted move is finished by running it again.
+#
+# For local testing point SQLALCHEMY_SHARD_URLS at extra SQLite files.
+
+# comma separated shard URLs, in the SQLALCHEMY_DATABASE_URL format
+SQLALCHEMY_SHARD_URLS = [
+    url.strip()
+    for url in os.environ.get("SQLALCHEMY_SHARD_URLS", "").split(",")
+    if url.strip()
+]
+
+# "range" or "hash"
+SHARD_STRATEGY = os.environ.get("SHARD_STRATEGY", "range")
+
+# user ids per shard of the range strategy
+SHARD_RANGE_SIZE = int(os.environ.get("SHARD_RANGE_SIZE", 100000))
+
+# todo ids per shard, the todos id column is a 32 bit integer on Postgres
+SHARD_ID_RANGE = int(os.environ.get("SHARD_ID_RANGE", 100_000_000))
+
+# seconds a user's shard is cached
+SHARD_MAP_TTL = float(os.environ.get("SHARD_MAP_TTL", 5))
+
+# users cached before the expired entries are dropped
+SHARD_MAP_MAX_USERS = 10000
+
+# rows copied per statement when moving a user
+MOVE_BATCH_SIZE = 1000
+
+# todos_version left on the source shard of a moved user
+MOVED = -1
+
+# tables holding a user's rows on their shard
+OWNER_MODELS = (Todo, ArchivedTodo, TodoStat, TodoImportBatch)
+
+
+def start_id_range(connection, index: int):
+    """
+    Make shard index allocate new todo ids from index * SHARD_ID_RANGE on.
+    Does nothing once the shard's ids are past that.
+    """
+    start = index * SHARD_ID_RANGE
+    if connection.dialect.name == "postgresql":
+        last_value = connection.scalar(
+            text(
+                "SELECT coalesce(pg_sequence_last_value("
+                "pg_get_serial_sequence('todos', 'id')::regclass), 0)"
+            )
+        )
+        if last_value < start:
+            connection.execute(
+                text("SELECT setval(pg_get_serial_sequence('todos', 'id'), :start)"),
+                {"start": start},
+            )
+    elif connection.dialect.name == "sqlite":
+        # only there when todos was created with AUTOINCREMENT
+        if connection.scalar(
+            text("SELECT name FROM sqlite_master WHERE name = 'sqlite_sequence'")
+        ):
+            seq = connection.scalar(
+                text("SELECT seq FROM sqlite_sequence WHERE name = 'todos'")
+            )
+            if seq is None:
+                connection.execute(
+                    text(
+                        "INSERT INTO sqlite_sequence (name, seq) VALUES ('todos', :start)"
+                    ),
+                    {"start": start},
+                )
+            elif seq < start:
+                connection.execute(
+                    text(
+                        "UPDATE sqlite_sequence SET seq = :start WHERE name = 'todos'"
+                    ),
+                    {"start": start},
+                )
+
+
+def dialect_insert(dialect: str):
+    """INSERT supporting on_conflict_do_update for dialect"""
+    return (postgresql if dialect == "postgresql" else sqlite).insert
+
+
+def upsert_user_row(dialect: str, owner_id: int, todos_version: int):
+    """Insert the stub users row of owner_id, or set todos_version of the existing one"""
+    statement = dialect_insert(dialect)(User).values(
+        id=owner_id, todos_version=todos_version
+    )
+    return statement.on_conflict_do_update(
+        index_elements=["id"], set_={"todos_version": todos_version}
+    )
+
+
+def insert_user_row(dialect: str, owner_id: int):
+    """Insert the stub users row of owner_id unless there is one"""
+    statement = dialect_insert(dialect)(User).values(id=owner_id, todos_version=0)
+    return statement.on_conflict_do_nothing(index_elements=["id"])
+
+
+class Shard(Replica):
+    """
+    Engines and session factory of a shard, created the same way as a replica's
+    """
+
+    async def prepare(self, index: int, create_schema: bool):
+        """Create missing tables when asked to and start the shard's todo id range"""
+
+        def prepare_connection(connection):
+            if create_schema:
+                database.Base.metadata.create_all(connection)
+            start_id_range(connection, index)
+
+        if database.DB_ASYNC_ENABLED:
+            async with self.async_engine.begin() as connection:
+                await connection.run_sync(prepare_connection)
+        else:
+            with self.engine.begin() as connection:
+                prepare_connection(connection)
+
+    def stats(self) -> dict:
+        """URL and pool state"""
+        return {
+            "url": make_url(self.url).render_as_string(hide_password=True),
+            "pool": self.pool_metrics.stats(),
+        }
+
+
+class ShardMap:
+    """
+    owner_id -> shard lookups, sessions on a shard and fan-out queries over all of them
+    """
+
+    def __init__(self, urls: list[str], strategy: str, range_size: int, ttl: float):
+        self.shards = [Shard(url) for url in urls]
+        self.strategy = strategy
+        self.range_size = range_size
+        self.ttl = ttl
+        # owner id -> (shard, end of the cache entry)
+        self.cached: dict[int, tuple[int, float]] = {}
+        self.lookups = 0
+
+    @property
+    def count(self) -> int:
+        """Number of shards, the primary included"""
+        return len(self.shards) + 1
+
+    async def start(self, create_schema: bool):
+        """Create the shard engines, and their tables when asked to"""
+        for index, shard in enumerate(self.shards, start=1):
+            shard.init_engine()
+            await shard.prepare(index, create_schema)
+
+    async def stop(self):
+        """Dispose the shard engines"""
+        for shard in self.shards:
+            await shard.dispose()
+
+    def default_shard(self, owner_id: int) -> int:
+        """Shard of a new user owner_id according to SHARD_STRATEGY"""
+        if self.strategy == "hash":
+            return owner_id % self.count
+        return min(owner_id // self.range_size, self.count - 1)
+
+    async def shard_of(self, owner_id: int | None) -> int:
+        """Shard holding the todos of owner_id"""
+        if not self.shards or owner_id is None:
+            return 0
+        now = monotonic()
+        cached = self.cached.get(owner_id)
+        if cached is not None and cached[1] > now:
+            return cached[0]
+
+        self.lookups += 1
+        db = database.new_db_session()
+        try:
+            index = await db.scalar(
+                select(ShardAssignment.shard).where(
+                    ShardAssignment.owner_id == owner_id
+                )
+            )
+        finally:
+            await db.close()
+        if index is None or index >= self.count:
+            index = 0
+
+        self.cached[owner_id] = (index, now + self.ttl)
+        if len(self.cached) > SHARD_MAP_MAX_USERS:
+            self.cached = {
+                key: entry for key, entry in self.cached.items() if entry[1] > now
+            }
+        return index
+
+    def forget(self, owner_id: int):
+        """Drop the cached shard of owner_id"""
+        self.cached.pop(owner_id, None)
+
+    def new_session(self, index: int, read: bool = False, user_id: int | None = None):
+        """
+        Session on shard index, for a read-only handler of user_id when read is set
+        (on a replica of the primary, see replicas.py). The caller is responsible for
+        closing it.
+        """
+        if index == 0:
+            if read:
+                return replica_set.new_read_session(user_id)
+            return database.new_db_session()
+        return self.shards[index - 1].new_session()
+
+    async def owner_session(self, owner_id: int | None, read: bool = False):
+        """Session on the shard of owner_id, see new_session"""
+        return self.new_session(await self.shard_of(owner_id), read, owner_id)
+
+    async def fan_out(self, statement) -> list[list]:
+        """Run a read-only statement on every shard concurrently, returns their rows"""
+
+        async def run(index: int):
+            db = self.new_session(index, read=True)
+            try:
+                return (await db.execute(statement)).all()
+            finally:
+                await db.close()
+
+        return await asyncio.gather(*(run(index) for index in range(self.count)))
+
+    async def add_user(self, db, user_id: int):
+        """
+        Assign a new user to their shard in the caller's transaction on the primary,
+        after creating their stub users row on that shard. The caller commits.
+        """
+        index = self.default_shard(user_id) if self.shards else 0
+        if index != 0:
+            shard = self.new_session(index)
+            try:
+                await shard.execute(
+                    upsert_user_row(shard.get_bind().dialect.name, user_id, 0)
+                )
+                await shard.commit()
+            finally:
+                await shard.close()
+        await db.execute(insert(ShardAssignment).values(owner_id=user_id, shard=index))
+
+    def stats(self) -> dict:
+        """Strategy, cached lookups and every shard's pool state"""
+        return {
+            "strategy": self.strategy,
+            "cached_users": len(self.cached),
+            "lookups": self.lookups,
+            "shards": [shard.stats() for shard in self.shards],
+        }
+
+
+shard_map = ShardMap(
+    SQLALCHEMY_SHARD_URLS, SHARD_STRATEGY, SHARD_RANGE_SIZE, SHARD_MAP_TTL
+)
+
+
+async def copy_owner_rows(source, target, owner_id: int):
+    """Copy the rows of owner_id in OWNER_MODELS from source to target, in batches"""
+    for model in OWNER_MODELS:
+        table = model.__table__
+        result = await source.stream(
+            select(*table.columns)
+            .where(table.c.owner_id == owner_id)
+            .execution_options(yield_per=MOVE_BATCH_SIZE)
+        )
+        async for rows in result.partitions():
+            await target.execute(insert(table), [row._asdict() for row in rows])
+
+
+async def move_owner(owner_id: int, target_index: int) -> int:
+    """
+    Move the todos of owner_id to shard target_index.
+    Returns the number of todos moved.
+    """
+    if not 0 <= target_index < shard_map.count:
+        raise ValueError(f"Shard {target_index} does not exist")
+    shard_map.forget(owner_id)
+    source_index = await shard_map.shard_of(owner_id)
+    if source_index == target_index:
+        raise ValueError(f"User {owner_id} is already on shard {target_index}")
+
+    source = shard_map.new_session(source_index)
+    target = shard_map.new_session(target_index)
+    primary = database.new_db_session()
+    moved = 0
+    try:
+        if target_index < source_index and target.get_bind().dialect.name == "sqlite":
+            raise ValueError(
+                f"User {owner_id} cannot be moved from shard {source_index} to the "
+                f"lower shard {target_index} on SQLite, its todo ids would be handed "
+                "out again"
+            )
+        # a no-op UPDATE locks the users row (the database on SQLite) against the
+        # version bump of every todo write until the source commits
+        version = await source.scalar(
+            update(User)
+            .where(User.id == owner_id)
+            .values(todos_version=User.todos_version)
+            .returning(User.todos_version)
+            .execution_options(synchronize_session=False)
+        )
+        if version is None:
+            # the stub users row was never created, so there is nothing to copy
+            await source.execute(
+                insert_user_row(source.get_bind().dialect.name, owner_id)
+            )
+            version = 0
+
+        if version == MOVED:
+            # an earlier move stopped before the assignment, finish it if the todos
+            # went to this target
+            target_version = await target.scalar(
+                select(User.todos_version).where(User.id == owner_id)
+            )
+            if target_version is None or target_version == MOVED:
+                raise ValueError(
+                    f"User {owner_id} was moved off shard {source_index}, "
+                    f"but not to shard {target_index}"
+                )
+            await source.rollback()
+        else:
+            # rows left by an earlier attempt that failed before its commit
+            for model in OWNER_MODELS:
+                await target.execute(delete(model).where(model.owner_id == owner_id))
+            await target.execute(
+                upsert_user_row(target.get_bind().dialect.name, owner_id, version + 1)
+            )
+            await copy_owner_rows(source, target, owner_id)
+            await target.commit()
+
+            for model in OWNER_MODELS:
+                result = await source.execute(
+                    delete(model).where(model.owner_id == owner_id)
+                )
+                if model is Todo:
+                    moved = result.rowcount
+            await source.execute(
+                update(User)
+                .where(User.id == owner_id)
+                .values(todos_version=MOVED)
+                .execution_options(synchronize_session=False)
+            )
+            await source.commit()
+
+        statement = dialect_insert(primary.get_bind().dialect.name)(
+            ShardAssignment
+        ).values(owner_id=owner_id, shard=target_index)
+        await primary.execute(
+            statement.on_conflict_do_update(
+                index_elements=["owner_id"], set_={"shard": target_index}
+            )
+        )
+        await primary.commit()
+        shard_map.forget(owner_id)
+    finally:
+        await source.close()
+        await target.close()
+        await primary.close()
+    return moved
+
+
+async def main(owner_id: int, target_index: int):
+    """Move a user against the configured databases"""
+    database.init_engines()
+    await shard_map.start(create_schema=False)
+    try:
+        moved = await move_owner(owner_id, target_index)
+        print(f"Moved user {owner_id} to shard {target_index}, {moved} todos")
+    finally:
+        await shard_map.stop()
+        await database.dispose_engines()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4 or sys.argv[1] != "move":
+        sys.exit(__doc__)
+    try:
+        asyncio.run(main(int(sys.argv[2]), int(sys.argv[3])))
+    except ValueError as exp:
+        sys.exit(str(exp))
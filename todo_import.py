@@ -0,0 +1,263 @@
+"""
+Streaming bulk import of todos from NDJSON or CSV uploads
+"""
+
+import codecs
+import csv
+import io
+import json
+import os
+from typing import Literal
+
+from fastapi import status
+from fastapi.encoders import jsonable_encoder
+from starlette.exceptions import HTTPException
+from pydantic import ValidationError
+from sqlalchemy import func, insert, select
+
+from archive import completion_time
+from models import Todo, TodoImportBatch
+from schemas import TodoCreate
+
+# The upload is parsed while it is received, one record at a time, and cut into batches
+# of IMPORT_BATCH_SIZE records. Every batch is validated with TodoCreate and inserted in
+# its own transaction together with a todo_import_batches row recording it, so memory use
+# is bounded by the batch size and not by the file.
+#
+# Batches are numbered by position in the upload, so sending the same file again with the
+# same import_id skips the batches already committed: an interrupted import is resumed
+# and a repeated one inserts nothing twice. Progress can be followed from another request
+# through the ledger.
+#
+# On Postgres the rows go in with COPY, elsewhere with a single executemany INSERT.
+
+IMPORT_FORMATS = Literal["ndjson", "csv"]
+
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", 1000))
+
+IMPORT_USE_COPY = os.environ.get("IMPORT_USE_COPY", "true").lower() == "true"
+
+# longest accepted record, a bigger one stops the import
+IMPORT_MAX_RECORD_BYTES = int(os.environ.get("IMPORT_MAX_RECORD_BYTES", 64 * 1024))
+
+# row errors listed in the response, the rest are only counted
+IMPORT_MAX_REPORTED_ERRORS = 100
+
+IMPORT_COLUMNS = (
+    "title",
+    "description",
+    "priority",
+    "is_complete",
+    "owner_id",
+    "category",
+    "todo_type",
+    "completed_at",
+)
+
+
+def record_too_long():
+    """Error for a record over IMPORT_MAX_RECORD_BYTES"""
+    return HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail={"msg": f"Records are limited to {IMPORT_MAX_RECORD_BYTES} bytes"},
+    )
+
+
+async def decoded_lines(chunks):
+    """
+    Yield the lines of a UTF-8 body received in chunks, without the line endings
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    pending = ""
+    try:
+        async for chunk in chunks:
+            pending += decoder.decode(chunk)
+            *lines, pending = pending.split("\n")
+            for line in lines:
+                if len(line) > IMPORT_MAX_RECORD_BYTES:
+                    raise record_too_long()
+                yield line.removesuffix("\r")
+            if len(pending) > IMPORT_MAX_RECORD_BYTES:
+                raise record_too_long()
+        pending += decoder.decode(b"", final=True)
+    except UnicodeDecodeError as exp:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail={"msg": "Upload is not valid UTF-8"},
+        ) from exp
+    if len(pending) > IMPORT_MAX_RECORD_BYTES:
+        raise record_too_long()
+    if pending:
+        yield pending.removesuffix("\r")
+
+
+async def ndjson_records(chunks):
+    """
+    Yield (row, record, error) for every non-empty line of an NDJSON body
+    """
+    row = 0
+    async for line in decoded_lines(chunks):
+        if not line.strip():
+            continue
+        row += 1
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield row, None, "Invalid JSON"
+            continue
+        if not isinstance(record, dict):
+            yield row, None, "Expected a JSON object"
+            continue
+        yield row, record, None
+
+
+async def csv_records(chunks):
+    """
+    Yield (row, record, error) for every record of a CSV body with a header row.
+    Quoted values may span lines, a record ends at a line break outside quotes.
+    """
+    header = None
+    row = 0
+    lines = []
+    quotes = 0
+    async for line in decoded_lines(chunks):
+        lines.append(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            if sum(len(part) for part in lines) > IMPORT_MAX_RECORD_BYTES:
+                raise record_too_long()
+            continue
+        text = "\n".join(lines)
+        lines, quotes = [], 0
+        if not text.strip():
+            continue
+        values = next(csv.reader([text]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        row += 1
+        if len(values) != len(header):
+            yield row, None, f"Expected {len(header)} values, got {len(values)}"
+            continue
+        yield row, dict(zip(header, values)), None
+    if lines:
+        yield row + 1, None, "Unterminated quoted value"
+
+
+def record_parser(import_format: str):
+    """Record parser of an upload format"""
+    return csv_records if import_format == "csv" else ndjson_records
+
+
+def validate_import_batch(batch: list[tuple], owner_id: int):
+    """
+    Validate the (row, record, error) tuples of a batch with TodoCreate.
+    Returns the todos to insert and the errors of the invalid rows.
+    """
+    todos, errors = [], []
+    for row, record, error in batch:
+        if error is not None:
+            errors.append({"row": row, "errors": [{"msg": error}]})
+            continue
+        try:
+            todo = TodoCreate.model_validate(record)
+        except ValidationError as exp:
+            errors.append(
+                {
+                    "row": row,
+                    "errors": jsonable_encoder(
+                        exp.errors(include_url=False, include_input=False)
+                    ),
+                }
+            )
+            continue
+        todos.append(
+            {
+                **todo.model_dump(),
+                "owner_id": owner_id,
+                "completed_at": completion_time(todo.is_complete),
+            }
+        )
+    return todos, errors
+
+
+async def committed_batches(db, owner_id: int, import_id: str) -> set[int]:
+    """Numbers of the batches of an import that have already been committed"""
+    return set(
+        await db.scalars(
+            select(TodoImportBatch.batch)
+            .where(TodoImportBatch.owner_id == owner_id)
+            .where(TodoImportBatch.import_id == import_id)
+        )
+    )
+
+
+async def record_import_batch(
+    db, owner_id: int, import_id: str, batch: int, rows: int, inserted: int, errors: int
+):
+    """
+    Add a batch to the ledger, in the transaction inserting its todos.
+    Raises IntegrityError when another upload of the same import committed it first.
+    """
+    await db.execute(
+        insert(TodoImportBatch).values(
+            owner_id=owner_id,
+            import_id=import_id,
+            batch=batch,
+            rows=rows,
+            inserted=inserted,
+            errors=errors,
+        )
+    )
+
+
+async def import_progress(db, owner_id: int, import_id: str) -> dict:
+    """Batches, records, inserted todos and row errors committed so far"""
+    batches, rows, inserted, errors = (
+        await db.execute(
+            select(
+                func.count(),
+                func.coalesce(func.sum(TodoImportBatch.rows), 0),
+                func.coalesce(func.sum(TodoImportBatch.inserted), 0),
+                func.coalesce(func.sum(TodoImportBatch.errors), 0),
+            )
+            .where(TodoImportBatch.owner_id == owner_id)
+            .where(TodoImportBatch.import_id == import_id)
+        )
+    ).one()
+    return {
+        "import_id": import_id,
+        "batches": batches,
+        "rows": rows,
+        "inserted": inserted,
+        "errors": errors,
+    }
+
+
+async def insert_todos(db, todos: list[dict]):
+    """
+    Insert todos with COPY on Postgres, a single executemany INSERT elsewhere.
+    Runs in the caller's transaction, which must already have executed a statement so
+    the driver has started it before the COPY.
+    """
+    bind = db.get_bind()
+    if IMPORT_USE_COPY and bind.dialect.name == "postgresql":
+        connection = await db.connection()
+        records = [tuple(todo[column] for column in IMPORT_COLUMNS) for todo in todos]
+        if bind.dialect.driver == "asyncpg":
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.copy_records_to_table(
+                "todos", records=records, columns=IMPORT_COLUMNS
+            )
+            return
+        if bind.dialect.driver == "psycopg2":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(records)
+            buffer.seek(0)
+            with connection.connection.dbapi_connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY todos ({', '.join(IMPORT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)",
+                    buffer,
+                )
+            return
+    await db.execute(insert(Todo.__table__), todos)
@@ -0,0 +1,173 @@
+"""
+Per-user todo statistics kept in the todo_stats summary table
+
+Rebuild the whole table from the todos, archived ones included, of the
+SQLALCHEMY_DATABASE_URL database and of every SQLALCHEMY_SHARD_URLS shard, with:
+
+    python todo_stats.py rebuild
+"""
+
+import asyncio
+import sys
+from collections import Counter
+from collections.abc import Iterable, Mapping
+
+from sqlalchemy import delete, func, insert, select, text, union_all
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from models import ArchivedTodo, Todo, TodoStat
+
+# todo_stats holds one row per (owner, dimension, value) with the number of the owner's
+# todos having that value, e.g. (1, "priority", "3", 12), plus a ("total", "") row.
+# Every todo write applies its delta to those rows with an upsert in its own transaction,
+# so the counts are always consistent with the todos and reading them costs a single
+# indexed lookup no matter how many todos the owner has.
+# Values are stored as strings: "true"/"false" for is_complete, the number for priority
+# and "" for NULL.
+# Archived todos (see archive.py) stay counted: archiving does not change the stats, and
+# the rebuild counts todos and todos_archive together.
+
+STATS_DIMENSIONS = ("is_complete", "priority", "category", "todo_type")
+
+STATS_COLUMNS = tuple(getattr(Todo, name) for name in STATS_DIMENSIONS)
+
+TOTAL = ("total", "")
+
+
+def stat_value(value) -> str:
+    """String stored for a column value"""
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    return str(value)
+
+
+def stats_delta(
+    added: Iterable[Mapping] = (), removed: Iterable[Mapping] = ()
+) -> Counter:
+    """
+    Count changes per (dimension, value) for the todos added and removed.
+    Todos are mappings of their columns, an update is the old values removed and the
+    new ones added.
+    """
+    delta = Counter()
+    for todos, sign in ((added, 1), (removed, -1)):
+        for todo in todos:
+            delta[TOTAL] += sign
+            for dimension in STATS_DIMENSIONS:
+                if dimension in todo:
+                    delta[(dimension, stat_value(todo[dimension]))] += sign
+    return delta
+
+
+def upsert(dialect: str):
+    """INSERT adding its count to the existing row of the same key"""
+    statement = (postgresql if dialect == "postgresql" else sqlite).insert(
+        TodoStat.__table__
+    )
+    return statement.on_conflict_do_update(
+        index_elements=["owner_id", "dimension", "value"],
+        set_={"count": TodoStat.__table__.c.count + statement.excluded.count},
+    )
+
+
+async def apply_stats_delta(db: AsyncSession, owner_id: int, delta: Counter):
+    """
+    Add delta to the owner's stats.
+    Runs in the caller's transaction. Keys are written in sorted order so concurrent
+    writers of the same owner lock the rows in the same order.
+    """
+    rows = [
+        {"owner_id": owner_id, "dimension": dimension, "value": value, "count": count}
+        for (dimension, value), count in sorted(delta.items())
+        if count
+    ]
+    if rows:
+        await db.execute(upsert(db.get_bind().dialect.name), rows)
+
+
+async def get_stats(db: AsyncSession, owner_id: int) -> dict:
+    """
+    Todo counts of owner_id, the total and per value of every dimension
+    """
+    stats = {"total": 0, **{dimension: {} for dimension in STATS_DIMENSIONS}}
+    rows = await db.execute(
+        select(TodoStat.dimension, TodoStat.value, TodoStat.count)
+        .where(TodoStat.owner_id == owner_id)
+        .where(TodoStat.count != 0)
+    )
+    for dimension, value, count in rows:
+        if (dimension, value) == TOTAL:
+            stats["total"] = count
+        elif dimension in stats:
+            stats[dimension][value] = count
+    return stats
+
+
+async def rebuild_stats(db: AsyncSession) -> int:
+    """
+    Recompute todo_stats from the todos and the archived todos with a single GROUP BY
+    over every dimension.
+    Returns the number of summary rows written. Commits.
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        # writers block on their stats upsert until the rebuild commits, so a write is
+        # either in the GROUP BY snapshot or applies its delta on top of the new rows
+        await db.execute(text("LOCK TABLE todo_stats IN EXCLUSIVE MODE"))
+    names = ["owner_id", *STATS_DIMENSIONS]
+    todos = union_all(
+        *(
+            select(*(table.c[name] for name in names))
+            for table in (Todo.__table__, ArchivedTodo.__table__)
+        )
+    ).subquery("todos")
+    columns = [todos.c[name] for name in names]
+    groups = await db.execute(select(*columns, func.count()).group_by(*columns))
+
+    deltas: dict[int, Counter] = {}
+    for owner_id, *values, count in groups:
+        todo = dict(zip(STATS_DIMENSIONS, values))
+        delta = deltas.setdefault(owner_id, Counter())
+        for key, change in stats_delta([todo]).items():
+            delta[key] += change * count
+
+    await db.execute(delete(TodoStat))
+    rows = [
+        {"owner_id": owner_id, "dimension": dimension, "value": value, "count": count}
+        for owner_id, delta in sorted(deltas.items())
+        for (dimension, value), count in sorted(delta.items())
+    ]
+    if rows:
+        await db.execute(insert(TodoStat.__table__), rows)
+    await db.commit()
+    return len(rows)
+
+
+async def main():
+    """Rebuild the stats against the configured databases"""
+    # pylint: disable=import-outside-toplevel
+    from database import dispose_engines, init_engines
+    from shards import shard_map
+
+    init_engines()
+    await shard_map.start(create_schema=False)
+    try:
+        for index in range(shard_map.count):
+            db = shard_map.new_session(index)
+            try:
+                print(
+                    f"Rebuilt todo stats of shard {index}, {await rebuild_stats(db)} rows"
+                )
+            finally:
+                await db.close()
+    finally:
+        await shard_map.stop()
+        await dispose_engines()
+
+
+if __name__ == "__main__":
+    if sys.argv[1:] != ["rebuild"]:
+        sys.exit(__doc__)
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""
+Cache of verified JWT claims
+"""
+
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from time import time
+
+# Clients reuse the same access token for up to an hour, so most requests present a token
+# that has already been verified. Verified claims are kept in a bounded LRU keyed by a
+# digest of the token (the raw token is never stored) and dropped at the token's exp, so a
+# cache hit is never valid for longer than the token itself.
+
+TOKEN_CACHE_SIZE = int(os.environ.get("TOKEN_CACHE_SIZE", 10000))
+
+
+def token_digest(token: str) -> str:
+    """SHA-256 digest used as the cache key for a token"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenCache:
+    """
+    Bounded LRU of decoded token claims that expire with the token
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.entries: OrderedDict[str, dict] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> dict | None:
+        """Return the cached claims of token, or None when not cached or expired"""
+        digest = token_digest(token)
+        with self.lock:
+            claims = self.entries.get(digest)
+            if claims is not None and claims.get("exp", 0) <= time():
+                del self.entries[digest]
+                claims = None
+            if claims is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(digest)
+            self.hits += 1
+            return claims
+
+    def peek(self, token: str) -> dict | None:
+        """Like get, but neither counted in the stats nor moved in the LRU order"""
+        digest = token_digest(token)
+        with self.lock:
+            claims = self.entries.get(digest)
+        if claims is None or claims.get("exp", 0) <= time():
+            return None
+        return claims
+
+    def put(self, token: str, claims: dict):
+        """Cache the verified claims of token, evicting the least recently used entry"""
+        if self.max_size <= 0 or "exp" not in claims:
+            return
+        digest = token_digest(token)
+        with self.lock:
+            self.entries[digest] = claims
+            self.entries.move_to_end(digest)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate_token(self, token: str):
+        """Drop a single token"""
+        with self.lock:
+            self.entries.pop(token_digest(token), None)
+
+    def invalidate_user(self, user_id: int):
+        """Drop every token issued to user_id"""
+        with self.lock:
+            for digest in [
+                digest
+                for digest, claims in self.entries.items()
+                if claims.get("id") == user_id
+            ]:
+                del self.entries[digest]
+
+    def stats(self) -> dict:
+        """Hit and miss counters"""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+token_cache = TokenCache(TOKEN_CACHE_SIZE)